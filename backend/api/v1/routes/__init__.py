@@ -6,3 +6,4 @@ api = Blueprint('api', __name__, url_prefix='/api/user/')
 from backend.api.v1.routes.user import *
 from backend.api.v1.routes.friends import *
 from backend.api.v1.routes.chats import *
+from backend.api.v1.routes.geofences import *
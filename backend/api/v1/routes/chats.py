@@ -5,31 +5,53 @@ from backend.api.v1.routes import api
 from backend.auth import AUTH
 from backend.db_ops.user_choices import Choice
 from backend.db_ops import db
+from backend.db_ops.presence import presence
+from backend.db_ops.database import MESSAGES_PAGE_SIZE, next_page_cursor
 
 CHOICE = Choice()
 
 
+@api.route('/inbox')
+def get_inbox() -> str:
+    ''' GET /api/user/inbox
+    Return:
+        Every conversation of the user with the friend summary, a preview
+        of the last message and the unread count, most recent first
+    '''
+    user = AUTH.authenticate_user()
+    if not user:
+        return jsonify({'error': 'unauthorized'}), 401
+    return jsonify({'conversations': db.get_inbox(user.id)})
+
+
 @api.route('/friend/conversation', methods=['POST'])
 def get_conversations() -> str:
     ''' POST /friend/
     creates a new conversation for user and friend if none exists
+    An optional `before` cursor and `limit` select an older page of messages
     Return:
-        All messages in the conversation involving user and friend
+        The newest page of messages in the conversation involving user and
+        friend under `messages`, with the cursor of the next (older) page,
+        the conversation id and the user's read cursor
     '''
     user = AUTH.authenticate_user()
     user_id = user.id
-    friend = request.get_json().get('friend')
-    friend = db.find_user_by(username=friend)
-    if friend:
-        friend_id = friend.id
-        if not AUTH.conversation_exists(user_id, friend_id):
-            conv_id = CHOICE.create_conversation(user_id, friend_id)
-        else:
-            conv_id = db.find_conversation_by(
-                participants=[user_id, friend_id]).id
-        messages = db.get_messages(conv_id)
-        messages['conversation_id'] = conv_id
-        return jsonify(messages)
+    data = request.get_json()
+    friend = data.get('friend')
+    friend_id = db.get_user_id(friend)
+    if friend_id:
+        conversation = db.get_or_create_conversation(user_id, friend_id)
+        if conversation is None:
+            return jsonify({"error": "Friend ID is required"}), 400
+        conv_id = conversation.id
+        messages = db.get_messages(conv_id, before=data.get('before'),
+                                   limit=data.get('limit', MESSAGES_PAGE_SIZE))
+        return jsonify({
+            'messages': messages,
+            'before': next_page_cursor(messages),
+            'conversation_id': conv_id,
+            'read_cursor': conversation.read_cursors.get(user_id, 0),
+        })
     else:
         return jsonify({"error": "Friend ID is required"}), 400
 
@@ -37,23 +59,23 @@ def get_conversations() -> str:
 @api.route('/friend/conversation/read', methods=['POST'])
 def mark_as_read() -> str:
     ''' POST api/user/friend/conversation/read
-    Marks read messages as read
+    Marks every message of the conversation up to the `cursor` sequence
+    number as read
     '''
     user = AUTH.authenticate_user()
     user_id = user.id
     conversation_id = request.get_json().get('conversation_id')
-    msg_id_list = request.get_json().get('messages')
-    if conversation_id and msg_id_list:
-        for msg_id in msg_id_list:
-            db.update_message(conversation_id, msg_id, read=True)
-        return jsonify({"success": "messages updated"})
+    cursor = request.get_json().get('cursor')
+    if conversation_id and isinstance(cursor, int):
+        if db.mark_conversation_read(conversation_id, user_id, cursor):
+            return jsonify({"success": "messages updated"})
     return jsonify({"error": "Invalid credentials"}), 400
 
 
 @api.route('/isInChat/update', methods=['POST'])
 def update_user_is_in_chat() -> str:
     ''' POST /api/user/isInChat/update
-    Updates is_in_chat property of a conversation between a user and friend
+    Records whether the user has the chat with a friend open
     '''
     user = AUTH.authenticate_user()
     if not user:
@@ -63,29 +85,19 @@ def update_user_is_in_chat() -> str:
     status = request.get_json().get('status')
 
     if friend:
-        friend_obj = db.find_user_by(username=friend)
-        if friend_obj:
-            friend_id = friend_obj.id
-            # validate friend id and prevent storage when they're not friends
-            if AUTH.is_a_valid_friend(user.id, friend_id)\
-                    and AUTH.is_a_valid_friend(friend_id, user_id):
-                participants = [user_id, friend_id]
-                conversation = db.find_conversation_by(
-                    participants=participants)
-                if not conversation:
-                    conversation = db.new_conversation(user_id, friend_id)
-
-                is_in_chat = conversation.is_in_chat
-                data = {
-                    user.username: status,
-                    friend: is_in_chat.get(friend)
-                }
-                conv_id = conversation.id
-                db.update_conversation(conv_id, is_in_chat=data)
-                return jsonify({"update": "success"})
-    # sets all is_in_chat property of user to false if no friend
-    # means user has not clicked on any friend
-    db.unmark_user_is_in_chats(user_id)
+        friend_id = db.get_user_id(friend)
+        if friend_id:
+            # prevent storage when they're not friends
+            if status is True:
+                if not AUTH.is_a_valid_friend(user_id, friend_id)\
+                        or not AUTH.is_a_valid_friend(friend_id, user_id):
+                    return jsonify({"error": "Invalid credentials"}), 400
+                presence.enter_chat(user_id, friend_id)
+            else:
+                presence.leave_chat(user_id, friend_id)
+            return jsonify({"update": "success"})
+    # user has not clicked on any friend, so is in no chat
+    presence.leave_chat(user_id)
     return jsonify({"update": "All set to false"})
 
 
@@ -95,9 +107,8 @@ def friend_is_in_chat() -> str:
     '''
     friend = request.get_json().get('friend')
     user_id = AUTH.authenticate_user().id
-    friend = db.find_user_by(username=friend)
-    if friend:
-        friend_id = friend.id
+    friend_id = db.get_user_id(friend)
+    if friend_id:
         status = CHOICE.friend_currently_in_chat(user_id, friend_id)
         return jsonify({"status": status})
     return jsonify({"error": "Invalid credentials"}), 400
@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 ''' Handles user-friend requests '''
-from flask import jsonify, request
+import json
+import time
+from flask import Response, jsonify, request, stream_with_context
 from flask_login import current_user, login_required
 from backend.api.v1.routes import api
 from backend.auth import AUTH
+from backend.api.v1.web_socket.location import location_subscriptions
 from backend.db_ops import db
+from backend.db_ops.location_store import is_valid_coordinates
+from backend.db_ops.presence import presence
 from backend.db_ops.user_choices import Choice
+from backend.models.helpers import location_coordinates
+from config import Config
 
 CHOICE = Choice()
 
+# Search radius of the nearby friends in meters
+NEARBY_RADIUS = 5000
+MAX_NEARBY_RADIUS = 100000
+
 
 @login_required
 @api.route('/friends')
@@ -16,16 +27,23 @@ def get_user_friends():
     ''' GET api/user/friends
     Retrieves all user friends and adds a new key (unread_messages)
     with a boolean value. True if user has unread message from friend
+    Friends also carry their online status and last_seen time
     '''
     user = AUTH.authenticate_user()
     user_dict = user.to_dict()
     friends = user_dict.get('friends')
-    for friend in friends.values():
+    # the unread counts of every conversation are fetched in one query
+    unread_counts = db.get_unread_counts(user.id)
+    # the latest online status and last_seen come from the presence store
+    friend_ids = list(friends)
+    online = presence.online(friend_ids)
+    last_seen = presence.last_seen(friend_ids)
+    for friend_id, friend in friends.items():
         # adds new key/value for unread messages
-        if AUTH.has_unread_messages(user.id, friend.get('id')):
-            friend["unread_messages"] = True
-        else:
-            friend["unread_messages"] = False
+        friend["unread_messages"] = unread_counts.get(friend.get('id'), 0) > 0
+        friend["online"] = online.get(friend_id, False)
+        friend["last_seen"] = last_seen.get(friend_id) or \
+            friend.get('last_seen')
     return jsonify(friends)
 
 
@@ -37,10 +55,9 @@ def add_friend():
     '''
     user = AUTH.authenticate_user()
     friend = request.get_json().get('friend')
-    friend = db.find_user_by(username=friend)
-    if not friend:
+    friend_id = db.get_user_id(friend)
+    if not friend_id:
         return jsonify({"error": "Invalid friend"}), 400
-    friend_id = friend.id
     if CHOICE.add_friend(user.id, friend_id):
         return jsonify({'status': 'friend added'})
     return jsonify({'status': 'something went wrong, check friend id'})
@@ -74,20 +91,21 @@ def allow_track_access():
 
     if request.method == 'POST':
         friend = request.get_json().get('friend')
-        friend = db.find_user_by(username=friend)
-        if not friend:
+        friend_id = db.get_user_id(friend)
+        if not friend_id:
             return jsonify({"error": "Invalid friend"}), 400
 
-        friend_id = friend.id
-
         if CHOICE.allow_track_access(user.id, friend_id):
             return jsonify({'status': 'Track permission allowed'})
         return jsonify(
             {'status': 'something went wrong, check friend id'}
             ), 400
     else:
-        # For GET requests
-        permitted_friends = user.allowed_tracks
+        # For GET requests, locations are sent as [lat, long] pairs
+        permitted_friends = {
+            friend_id: dict(friend, location=location_coordinates(
+                friend.get('location')))
+            for friend_id, friend in user.allowed_tracks.items()}
         return jsonify({'friends': permitted_friends})
 
 
@@ -110,13 +128,13 @@ def disallow_track_access():
     '''
     user = AUTH.authenticate_user()
     friend = request.get_json().get('friend')
-    friend = db.find_user_by(username=friend)
-    if not friend:
+    friend_id = db.get_user_id(friend)
+    if not friend_id:
         return jsonify({"error": "Invalid friend"}), 400
 
-    friend_id = friend.id
-
     if CHOICE.remove_track_access(user.id, friend_id):
+        # stops streaming the user location to the friend
+        location_subscriptions.revoke(user.id, friend_id)
         return jsonify({'status': 'Track permission disallowed'})
     return jsonify({'status': 'something went wrong, check friend id'}), 400
 
@@ -141,6 +159,86 @@ def get_friend_location():
         return jsonify({"error": "Friend has no location"}), 404
 
 
+@login_required
+@api.route('/friends/locations')
+def get_friends_locations():
+    ''' GET /api/user/friends/locations
+    Retrieves the current location of every friend that gave user the
+    allow_track permission, friends without a location map to null.
+    The response carries an ETag, a request whose If-None-Match matches
+    the current snapshot is answered with 304 Not Modified
+    '''
+    user_id = AUTH.authenticate_user().id
+    locations = CHOICE.get_friends_locations(user_id)
+    if locations is None:
+        return jsonify({"error": "Invalid user"}), 400
+
+    response = jsonify({'locations': locations})
+    response.add_etag()
+    # clients must revalidate the snapshot on every request
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@login_required
+@api.route('/friend/trail')
+def get_friend_trail():
+    ''' GET /api/user/friend/trail?friend=<username>[&since=<s>&until=<s>]
+    Streams the path of a friend over a time window, given in seconds since
+    the epoch (the last 24 hours by default), as newline delimited JSON.
+    Every line holds one hour of history: its first fix time, the offsets
+    of the fixes in seconds and their [lat, long] as an encoded polyline
+    '''
+    user_id = AUTH.authenticate_user().id
+    friend = request.args.get('friend')
+    if not friend:
+        return jsonify({"error": "Invalid friend"}), 400
+
+    until = request.args.get('until', int(time.time()), type=int)
+    since = request.args.get('since', until - 86400, type=int)
+    if since is None or until is None or not 0 <= since <= until\
+            or until - since > Config.LOCATION_TRAIL_MAX_HOURS * 3600:
+        return jsonify({"error": "Invalid time window"}), 400
+
+    chunks = CHOICE.get_friend_trail(user_id, friend, since, until)
+    if chunks is None:
+        return jsonify({"error": "Invalid friend/ no track access"}), 400
+    lines = (json.dumps(chunk) + '\n' for chunk in chunks)
+    return Response(stream_with_context(lines),
+                    mimetype='application/x-ndjson')
+
+
+@login_required
+@api.route('/friends/nearby')
+def get_nearby_friends():
+    ''' GET /api/user/friends/nearby?radius=<meters>[&lat=<lat>&lng=<lng>]
+    Retrieves the friends that gave user the allow_track permission and
+    are within radius meters (5000 by default) of the given point, or of
+    the user's location when no point is given, nearest first
+    '''
+    user_id = AUTH.authenticate_user().id
+    radius = request.args.get('radius', NEARBY_RADIUS, type=float)
+    if not 0 < radius <= MAX_NEARBY_RADIUS:
+        return jsonify(
+            {"error": f"radius must be within 0 and {MAX_NEARBY_RADIUS}"}
+            ), 400
+
+    origin = None
+    if 'lat' in request.args or 'lng' in request.args:
+        origin = [request.args.get('lat', type=float),
+                  request.args.get('lng', type=float)]
+        if not is_valid_coordinates(origin):
+            return jsonify({"error": "Invalid lat/lng"}), 400
+
+    friends = CHOICE.get_nearby_friends(user_id, radius, origin)
+    if friends is None:
+        return jsonify({"error": "Invalid user"}), 400
+    if friends is False:
+        return jsonify({"error": "Your location is turned off"}), 404
+    return jsonify({'friends': friends})
+
+
 @api.route('/friends/search', methods=['POST'])
 def search_friends():
     ''' POST /api/user/friends/search
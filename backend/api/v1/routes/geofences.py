@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+''' Handles user geofence requests '''
+from flask import jsonify, request
+from flask_login import login_required
+from backend.api.v1.routes import api
+from backend.auth import AUTH
+from backend.db_ops.geofences import geofences
+
+
+@login_required
+@api.route('/geofences', methods=['GET', 'POST'])
+def user_geofences():
+    ''' POST /api/user/geofences
+    Creates a named zone, friends tracked by user entering or leaving it
+    trigger a notification. Expects name, latitude, longitude and radius
+    (in meters)
+
+        GET /api/user/geofences
+    Retrieves all the zones of user
+    '''
+    user = AUTH.authenticate_user()
+
+    if request.method == 'POST':
+        data = request.get_json()
+        geofence = geofences.add(
+            user.id, data.get('name'),
+            [data.get('latitude'), data.get('longitude')],
+            data.get('radius'))
+        if geofence is None:
+            return jsonify({'error': 'Invalid zone or too many zones'}), 400
+        return jsonify({'geofence': geofence}), 201
+    return jsonify({'geofences': geofences.get(user.id)})
+
+
+@login_required
+@api.route('/geofences/<geofence_id>', methods=['DELETE'])
+def delete_geofence(geofence_id):
+    ''' DELETE /api/user/geofences/<geofence_id>
+    Deletes a zone of user
+    '''
+    user = AUTH.authenticate_user()
+    if geofences.delete(user.id, geofence_id):
+        return jsonify({'status': 'zone deleted'})
+    return jsonify({'error': 'Zone not found'}), 404
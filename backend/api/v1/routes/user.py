@@ -4,10 +4,14 @@ from flask import jsonify, request, url_for
 from flask_login import current_user, login_required
 from backend.api.v1.routes import api
 from backend.auth import AUTH
+from backend.api.v1.web_socket.location import notify_geofence_transitions,\
+    publish_location
+from backend.api.v1.web_socket.sessions import end_user_sockets
 from backend.db_ops.user_choices import Choice
-from backend.db_ops.database import DB
+from backend.db_ops import db
+from backend.db_ops.geofences import geofences
+from backend.db_ops.tracking_acl import tracking_acl
 
-db = DB()
 CHOICE = Choice()
 
 
@@ -45,9 +49,14 @@ def update_location() -> str:
 
     user_id = current_user.get_id()
 
-    if CHOICE.set_location(user_id, location):
-        return jsonify({'status': 'success'})
-    return jsonify({'status': 'failure'}), 400
+    stored = CHOICE.set_location(user_id, location)
+    if stored is None:
+        return jsonify({'status': 'failure'}), 400
+    if stored:
+        # pushes the new location to the friends viewing the user on the map
+        publish_location(current_user, location)
+        notify_geofence_transitions(current_user, location)
+    return jsonify({'status': 'success'})
 
 @api.route('remove', methods=['DELETE'])
 def remove_user():
@@ -79,6 +88,9 @@ def remove_user():
     # finally delete user
     status = db.remove_user(user.id)
     if status:
+        end_user_sockets(user.id)
+        geofences.delete_all(user.id)
+        tracking_acl.delete(user.id)
         redirect_url = url_for('pub_views.landing_page')
 
         # Return a JSON response with the redirect URL
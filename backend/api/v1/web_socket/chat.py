@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 ''' Chat web socket functionality module '''
 from flask import session, request
-from flask_login import current_user
 from flask_socketio import emit, join_room, send
 from backend.api.v1.web_socket.notifications import socket_io
+from backend.api.v1.web_socket.sessions import current_socket_user
+from backend.auth import AUTH
 from backend.db_ops import db
+from backend.db_ops.presence import presence
+from backend.db_ops.database import next_page_cursor
+
+
+def is_participant(user, conversation_id) -> bool:
+    ''' Verifies if the user of a socket takes part in a conversation '''
+    if user is None or not isinstance(conversation_id, str):
+        return False
+    conversation = db.find_conversation_by(id=conversation_id)
+    return conversation is not None\
+        and user.id in conversation.participants
 
 
 @socket_io.on('join')
@@ -13,11 +25,34 @@ def on_join(data):
     room = data.get('room')
     friend = data.get('friend')
     user_sid = request.sid
+    # only the participants of the conversation may read it
+    if not is_participant(current_socket_user(), room):
+        return
 
     join_room(room, user_sid)
     messages_dict = db.get_messages(room)  # room is the conversation id
-    # Broadcast prev chats to only user that joined the room
-    emit('prevMessages', {"messages": messages_dict}, room=user_sid)
+    # Broadcast the newest page of prev chats to only user that joined the room
+    emit('prevMessages', {"messages": messages_dict,
+                          "before": next_page_cursor(messages_dict)},
+         room=user_sid)
+
+
+@socket_io.on('loadOlderMessages')
+def load_older_messages(data):
+    ''' Sends the page of messages older than the `before` cursor to the
+    user scrolling up a conversation
+    '''
+    room = data.get('room')
+    before = data.get('before')
+    if not room or not isinstance(before, int):
+        return
+    if not is_participant(current_socket_user(), room):
+        return
+
+    messages_dict = db.get_messages(room, before=before)
+    emit('olderMessages', {"messages": messages_dict,
+                           "before": next_page_cursor(messages_dict)},
+         room=request.sid)
 
 
 @socket_io.on('newMessage')
@@ -25,12 +60,54 @@ def new_message(data):
     ''' Handles new messages '''
     room = data.get('room')
     friend = data.get('friend')
-    friend = db.find_user_by(username=friend)
-    if friend:
-        friend_id = friend.id
+    user = current_socket_user()
+    if user is None:
+        return
+    friend_id = db.get_user_id(friend)
+    if friend_id:
         message = data.get('message')
-        user_id = current_user.get_id()
-        username = db.find_user_by(id=user_id).username
-        db.new_message(user_id, friend_id, message)
-        emit("chat", {"message": message, "sender": username}, to=room)
+        user_id = user.id
+        stored = db.new_message(user_id, friend_id, message)
+        if stored:
+            emit("chat", {"message": stored['content'],
+                          "sender": stored['sender'],
+                          "seq": stored['seq']}, to=room)
+            return
     emit('send error message', {"message": "User does not exist anymore"})
+
+
+@socket_io.on('enterChat')
+def enter_chat(data):
+    ''' Records that the user opened the chat with a friend, clients repeat
+    it as a heartbeat while the chat stays open
+    '''
+    user = current_socket_user()
+    if user is None:
+        return
+    friend_id = db.get_user_id(data.get('friend'))
+    if not friend_id:
+        return
+    # prevent storage when they're not friends, the friendship is only
+    # checked when the chat is opened, not on every heartbeat
+    if presence.chat_of(user.id) != friend_id\
+            and not (AUTH.is_a_valid_friend(user.id, friend_id)
+                     and AUTH.is_a_valid_friend(friend_id, user.id)):
+        return
+    presence.enter_chat(user.id, friend_id)
+
+
+@socket_io.on('leaveChat')
+def leave_chat(data=None):
+    ''' Records that the user closed the chat with a friend, or any chat
+    when no friend is given
+    '''
+    user = current_socket_user()
+    if user is None:
+        return
+    friend = data.get('friend') if isinstance(data, dict) else None
+    if friend:
+        friend_id = db.get_user_id(friend)
+        if friend_id:
+            presence.leave_chat(user.id, friend_id)
+        return
+    presence.leave_chat(user.id)
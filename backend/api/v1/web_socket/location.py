@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+''' Websocket friend location stream module
+A user viewing a friend on the map subscribes to the friend's location
+instead of polling it. Subscriptions live in Redis, in the hash
+location_subscribers:{friend_id} mapping the sids of the subscribed sockets
+to their users, so locations received by any worker reach them. Every
+subscriber receives at most one location per LOCATION_PUSH_INTERVAL_MS. The
+latest location held back within an interval is kept in location_pending
+and delivered once the interval is over, so a friend who stops moving is
+never shown at an older position.
+'''
+import json
+import threading
+import time
+from typing import Dict, List, Union
+from flask import request
+from flask_socketio import emit
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
+from backend.api.v1.web_socket import socket_io
+from backend.api.v1.web_socket.sessions import current_socket_user
+from backend.db_ops import db
+from backend.db_ops.connections import get_redis_connection
+from backend.db_ops.geofences import geofences
+from backend.db_ops.presence import presence
+from backend.db_ops.redis import RedisClient
+from backend.db_ops.tracking_acl import tracking_acl
+from backend.db_ops.user_choices import Choice
+from config import Config
+
+CHOICE = Choice()
+redis_client = RedisClient()
+
+# Subscriptions are dropped after a day without being renewed, in case the
+# socket of a crashed worker never unsubscribed
+SUBSCRIPTION_TTL = 86400
+# Locations held back from subscribers, the {sid}:{friend_id} members are
+# scored by the millisecond their push interval ends and their payload is
+# kept in the data hash
+PENDING_KEY = 'location_pending'
+PENDING_DATA_KEY = 'location_pending:data'
+PENDING_BATCH_SIZE = 500
+
+# Pops the held back locations whose push interval is over, ARGV are the
+# current millisecond, the push interval and the batch size. A location is
+# only delivered if it claims the next interval, otherwise a newer location
+# was pushed in the meantime. Returns a flat list of member, payload pairs
+DELIVER_PENDING_SCRIPT = '''
+local members = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+    'LIMIT', 0, ARGV[3])
+local due = {}
+for _, member in ipairs(members) do
+    redis.call('ZREM', KEYS[1], member)
+    local payload = redis.call('HGET', KEYS[2], member)
+    redis.call('HDEL', KEYS[2], member)
+    if payload and redis.call('SET', 'location_push:' .. member, 1, 'NX',
+                              'PX', ARGV[2]) then
+        table.insert(due, member)
+        table.insert(due, payload)
+    end
+end
+return due
+'''
+
+
+class LocationSubscriptions:
+    ''' Friend location subscriptions of sockets '''
+    def __init__(self) -> None:
+        self._redis_client = get_redis_connection()
+        self._deliver_pending = self._redis_client.register_script(
+            DELIVER_PENDING_SCRIPT)
+        # friend each socket of this worker is subscribed to
+        self._friends = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, sid: str, user_id: str, friend_id: str) -> None:
+        ''' Subscribes a socket to a friend's location, replacing the
+        previous subscription of the socket
+        '''
+        self.unsubscribe(sid)
+        key = f'location_subscribers:{friend_id}'
+        pipe = self._redis_client.pipeline()
+        pipe.hset(key, sid, user_id)
+        pipe.expire(key, SUBSCRIPTION_TTL)
+        pipe.execute()
+        with self._lock:
+            self._friends[sid] = friend_id
+
+    def unsubscribe(self, sid: str) -> None:
+        ''' Drops the subscription of a socket '''
+        with self._lock:
+            friend_id = self._friends.pop(sid, None)
+        if friend_id is not None:
+            self._redis_client.hdel(f'location_subscribers:{friend_id}', sid)
+
+    def revoke(self, friend_id: str, user_id: str) -> None:
+        ''' Drops the subscriptions of a user to a friend's location, e.g.
+        when the friend disallows tracking
+        '''
+        key = f'location_subscribers:{friend_id}'
+        sids = [sid for sid, subscriber in
+                self._redis_client.hgetall(key).items()
+                if subscriber == user_id]
+        if sids:
+            self._redis_client.hdel(key, *sids)
+
+    def due_subscribers(self, friend_id: str, payload: Dict) -> List[str]:
+        ''' Returns the sids subscribed to a friend's location that may be
+        sent a new location, i.e. whose user is allowed to track the friend
+        and who were not sent one within the last LOCATION_PUSH_INTERVAL_MS.
+        The payload is held back for the others until their interval ends,
+        and the subscriptions of sockets no longer connected are dropped
+        '''
+        key = f'location_subscribers:{friend_id}'
+        subscribers = self._redis_client.hgetall(key)
+        if not subscribers:
+            return []
+        live = presence.live_sockets(subscribers)
+        dead = [sid for sid in subscribers if sid not in live]
+        if dead:
+            self._redis_client.hdel(key, *dead)
+        trackers = set(tracking_acl.filter_trackers(
+            friend_id, list({subscribers[sid] for sid in live})))
+        sids = [sid for sid in live if subscribers[sid] in trackers]
+        if not sids:
+            return []
+        interval = Config.LOCATION_PUSH_INTERVAL_MS
+        pipe = self._redis_client.pipeline(transaction=False)
+        for sid in sids:
+            pipe.set(f'location_push:{sid}:{friend_id}', 1, nx=True,
+                     px=interval)
+            pipe.pttl(f'location_push:{sid}:{friend_id}')
+        results = pipe.execute()
+
+        due, now = [], int(time.time() * 1000)
+        pipe = self._redis_client.pipeline()
+        for sid, is_due, ttl in zip(sids, results[::2], results[1::2]):
+            member = f'{sid}:{friend_id}'
+            if is_due:
+                # an older held back location must not follow this one
+                due.append(sid)
+                pipe.zrem(PENDING_KEY, member)
+                pipe.hdel(PENDING_DATA_KEY, member)
+            else:
+                pipe.hset(PENDING_DATA_KEY, member, json.dumps(payload))
+                pipe.zadd(PENDING_KEY, {member: now + max(ttl, 0)})
+        pipe.execute()
+        return due
+
+    def pop_pending(self) -> List[Dict]:
+        ''' Returns the held back locations whose push interval is over,
+        each one is returned to a single worker
+        Return:
+            The deliveries, in the format [{'sid': ..., 'payload': ...}]
+        '''
+        result = self._deliver_pending(
+            keys=[PENDING_KEY, PENDING_DATA_KEY],
+            args=[int(time.time() * 1000), Config.LOCATION_PUSH_INTERVAL_MS,
+                  PENDING_BATCH_SIZE])
+        return [{'sid': result[i].split(':', 1)[0],
+                 'payload': json.loads(result[i + 1])}
+                for i in range(0, len(result), 2)]
+
+
+location_subscriptions = LocationSubscriptions()
+
+
+def publish_location(user, location: Union[List[float], None]) -> None:
+    ''' Pushes the new location of a user to the sockets subscribed to it
+    user is the moving user, location is [latitude, longitude]
+    '''
+    payload = {'friend': user.username, 'location': location}
+    for sid in location_subscriptions.due_subscribers(user.id, payload):
+        socket_io.emit('friendLocation', payload, room=sid)
+
+
+def deliver_pending_locations() -> None:
+    ''' Sends the held back locations whose push interval is over '''
+    while True:
+        deliveries = location_subscriptions.pop_pending()
+        for delivery in deliveries:
+            socket_io.emit('friendLocation', delivery['payload'],
+                           room=delivery['sid'])
+        if len(deliveries) < PENDING_BATCH_SIZE:
+            return
+
+
+def notify_geofence_transitions(user, location: List[float]) -> None:
+    ''' Notifies the friends tracking a user when the user enters or leaves
+    one of their geofences. Failures are logged, they never fail the
+    location update
+    '''
+    try:
+        transitions = geofences.transitions(user.id, list(user.tracking_me),
+                                            location)
+        for transition in transitions:
+            action = 'entered' if transition['entered'] else 'left'
+            message = f"{user.username} {action} {transition['zone']}"
+            if redis_client.new_notification(user.id, transition['owner_id'],
+                                             message, 'general'):
+                socket_io.emit('alert_user', room=transition['owner_id'])
+    except (PyMongoError, RedisError) as e:
+        print(f'Error: geofence check failed: {e}')
+
+
+@socket_io.on('subscribeLocation')
+def subscribe_location(data):
+    ''' Subscribes the socket to the location of a friend that allowed the
+    user to track them, and sends the current location right away
+    '''
+    user = current_socket_user()
+    if user is None:
+        return
+    friend = data.get('friend')
+    if not friend:
+        return
+    location = CHOICE.get_friend_location(user.id, friend)
+    if location is None:
+        emit('locationError', {
+            'friend': friend, 'subscribed': False,
+            'message': f'{friend} did not grant you track access or no more '
+                       'exist'})
+        return
+
+    location_subscriptions.subscribe(request.sid, user.id,
+                                     db.get_user_id(friend))
+    if location is False:
+        # stays subscribed to receive the location once it is turned on
+        emit('locationError', {
+            'friend': friend, 'subscribed': True,
+            'message': f"{friend}'s location is currently unavailable."})
+        return
+    emit('friendLocation', {'friend': friend, 'location': location})
+
+
+@socket_io.on('unsubscribeLocation')
+def unsubscribe_location():
+    ''' Drops the location subscription of the socket '''
+    location_subscriptions.unsubscribe(request.sid)
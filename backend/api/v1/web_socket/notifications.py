@@ -3,9 +3,14 @@
 from flask import jsonify, request
 from flask_socketio import emit, join_room, disconnect
 from backend.api.v1.web_socket import socket_io
+from backend.api.v1.web_socket.location import location_subscriptions
+from backend.api.v1.web_socket.sessions import current_socket_user,\
+    socket_sessions
 from backend.auth import AUTH
 from backend.db_ops import db
-from backend.db_ops.redis import RedisClient
+from backend.db_ops.presence import presence
+from backend.db_ops.redis import MAX_NOTIFICATIONS_PAGE_SIZE,\
+    NOTIFICATIONS_PAGE_SIZE, RedisClient, next_notification_cursor
 
 redis_client = RedisClient()
 
@@ -20,23 +25,34 @@ def handle_connection():
         user = AUTH.authenticate_user()
         if user:
             user_id = user.id
+            socket_sessions.open(request.sid, user)
             join_room(user_id)
 
             # check if user has unread notification and alert if true
-            unread_notifications = redis_client.get_unread_notifications(user_id)
-            if len(unread_notifications) > 0:
+            if redis_client.count_unread_notifications(user_id) > 0:
                 emit('alert_user', room=user_id)
-
-            # deletes every message > threshold day
-            redis_client.delete_read_notifications_older_than(user_id, 15)
     except Exception:
         disconnect()  # disconnect if user is not authenticated
 
 
+@socket_io.on('disconnect')
+def handle_disconnection():
+    ''' Drops the session context and the location subscription of a
+    disconnected socket, and the chat presence once the user has no other
+    socket open
+    '''
+    location_subscriptions.unsubscribe(request.sid)
+    user = socket_sessions.close(request.sid)
+    if user is not None and not presence.sockets_of(user.id):
+        presence.leave_chat(user.id)
+
+
 @socket_io.on('new_friend_request')
 def send_friend_request(data):
     ''' Handles friend requests '''
-    user = AUTH.authenticate_user()
+    user = current_socket_user()
+    if user is None:
+        return
     friend_data = data.get('data')
 
     if friend_data:
@@ -57,7 +73,7 @@ def send_friend_request(data):
             emit('error', {'message': 'You cannot add yourself as a friend!'},
                  room=user.id)
             return
-        if friend.id in user.friends:
+        if user.id in friend.friends:
             emit('error', {'message': f'{friend_data} is already your friend'},
                  room=user.id)
             return
@@ -77,20 +93,48 @@ def send_friend_request(data):
     emit('error', {'message': 'Enter a username or email'}, room=user.id)
 
 
+def notification_page(fetch, user_id: str, data) -> dict:
+    ''' Fetches the page of a notification stream selected by the optional
+    `before`, `since` and `limit` of an event payload
+    Return:
+        The page with the cursor of the next page, older than it or newer
+        than it for a page with only `since`, and the `before` / `since` it
+        answers
+    '''
+    data = data if isinstance(data, dict) else {}
+    limit = data.get('limit')
+    if not isinstance(limit, int) or limit < 1:
+        limit = NOTIFICATIONS_PAGE_SIZE
+    limit = min(limit, MAX_NOTIFICATIONS_PAGE_SIZE)
+    before, since = data.get('before'), data.get('since')
+    page = fetch(user_id, before=before, since=since, limit=limit)
+    newer = isinstance(since, int) and not isinstance(before, int)
+    return {'data': page,
+            'next': next_notification_cursor(page, limit, newer=newer),
+            'before': before, 'since': since}
+
+
 @socket_io.on('get_friend_requests')
-def get_friend_requests():
-    ''' Handles retrieval of friend requests '''
-    user_id = AUTH.authenticate_user().id
-    friend_reqs = redis_client.get_friend_requests(user_id)
-    emit('user_friend_requests', {'data': friend_reqs})
+def get_friend_requests(data=None):
+    ''' Handles retrieval of a page of friend requests '''
+    user = current_socket_user()
+    if user is None:
+        return
+    user_id = user.id
+    emit('user_friend_requests',
+         notification_page(redis_client.get_friend_requests, user_id, data))
 
 
 @socket_io.on('get_general_notifications')
-def get_general_notifications():
-    ''' Handles retrieval of user general notifications '''
-    user_id = AUTH.authenticate_user().id
-    gen_notifications = redis_client.get_general_notifications(user_id)
-    emit('show_general_notifications', {'data': gen_notifications})
+def get_general_notifications(data=None):
+    ''' Handles retrieval of a page of user general notifications '''
+    user = current_socket_user()
+    if user is None:
+        return
+    user_id = user.id
+    emit('show_general_notifications',
+         notification_page(redis_client.get_general_notifications, user_id,
+                           data))
 
 
 @socket_io.on('accepted_request')
@@ -98,10 +142,11 @@ def handle_accepted_friend_request(data):
     ''' Handles accepted friend request notification '''
     friend = data.get('friend')
     notification_id = data.get('id')
-    user = AUTH.authenticate_user()
-    friend_obj = db.find_user_by(username=friend)
-    if friend_obj:
-        friend_id = friend_obj.id
+    user = current_socket_user()
+    if user is None:
+        return
+    friend_id = db.get_user_id(friend)
+    if friend_id:
         # Creat a new notification and alert friend that his request is
         # accepted
         message = f'{user.username} accepted your friend request'
@@ -111,7 +156,7 @@ def handle_accepted_friend_request(data):
         if notification:
             emit('alert_user', room=friend_id)
             emit('success', {
-                'message': f'You are now friends with {friend_obj.username}'
+                'message': f'You are now friends with {friend}'
                 }, room=user.id)
             # reload the general notifications of the friend
             emit('reload_general_notification', room=friend_id)
@@ -127,7 +172,9 @@ def handle_accepted_friend_request(data):
 @socket_io.on('mark as read')
 def mark_notification_as_read(data):
     ''' Marks a notification as read '''
-    user = AUTH.authenticate_user()
+    user = current_socket_user()
+    if user is None:
+        return
     notification_id = str(data.get('id'))
     status = redis_client.mark_as_read(user.id, notification_id)
     if status:
@@ -137,7 +184,9 @@ def mark_notification_as_read(data):
 @socket_io.on('delete friend request')
 def delete_notification(data):
     ''' Deletes a given user friend request when rejected '''
-    user = AUTH.authenticate_user()
+    user = current_socket_user()
+    if user is None:
+        return
     notification_id = str(data.get('id'))
     status = redis_client.delete_notification(user.id, notification_id)
     if status:
@@ -148,7 +197,10 @@ def delete_notification(data):
 def delete_all_notifications():
     ''' Deletes all user notifications '''
     print('entered here')
-    user_id = AUTH.authenticate_user().id
+    user = current_socket_user()
+    if user is None:
+        return
+    user_id = user.id
     status = redis_client.delete_all_notifications(user_id)
     if status:
         print('done')
@@ -163,17 +215,21 @@ def allowed_track(data):
     notifies user too.
     route has already done verifications
     '''
-    user = AUTH.authenticate_user()
+    user = current_socket_user()
+    if user is None:
+        return
     friend_name = data.get('friend')
-    friend = db.find_user_by(username=friend_name)
+    friend_id = db.get_user_id(friend_name)
+    if not friend_id:
+        return
 
     message = f"{user.username} granted you access to track them"
-    notif = redis_client.new_notification(user.id, friend.id, message,
+    notif = redis_client.new_notification(user.id, friend_id, message,
                                           'general')
     if notif:
-        emit('alert_user', room=friend.id)
+        emit('alert_user', room=friend_id)
     user_msg = f"You allowed {friend_name} to track you"
-    user_notif = redis_client.new_notification(friend.id, user.id, user_msg,
+    user_notif = redis_client.new_notification(friend_id, user.id, user_msg,
                                                'general')
     if user_notif:
         emit('alert_user', room=user.id)
@@ -182,12 +238,16 @@ def allowed_track(data):
 @socket_io.on('disallowed track')
 def disallowed_track(data):
     ''' Notifies user when a track is disallowed by user '''
-    user = AUTH.authenticate_user()
+    user = current_socket_user()
+    if user is None:
+        return
     friend_name = data.get('friend')
-    friend = db.find_user_by(username=friend_name)
+    friend_id = db.get_user_id(friend_name)
+    if not friend_id:
+        return
 
     message = f"You disallowed {friend_name} from tracking you"
-    notif = redis_client.new_notification(friend.id, user.id, message,
+    notif = redis_client.new_notification(friend_id, user.id, message,
                                           'general')
     if notif:
         emit('alert_user', room=user.id)
@@ -198,7 +258,10 @@ def verify_then_delete(data):
     ''' Verifies if both friends have unfriend themselves
     then delete the conversation (containing all messages)
     '''
-    user_id = AUTH.authenticate_user().id
+    user = current_socket_user()
+    if user is None:
+        return
+    user_id = user.id
     friend_id = data.get('friend_id')
     status = AUTH.confirm_and_delete(user_id, friend_id)
     if status:
@@ -211,7 +274,10 @@ def verify_then_delete(data):
 @socket_io.on('send error message')
 def send_error_notification(data):
     ''' Sends an error message to a user '''
-    user_id = AUTH.authenticate_user().id
+    user = current_socket_user()
+    if user is None:
+        return
+    user_id = user.id
     message = data.get('message')
     emit('error', {'message': message}, room=user_id)
 
@@ -219,7 +285,10 @@ def send_error_notification(data):
 @socket_io.on('send success message')
 def send_success_notification(data):
     ''' Sends a success message to a user '''
-    user_id = AUTH.authenticate_user().id
+    user = current_socket_user()
+    if user is None:
+        return
+    user_id = user.id
     message = data.get('message')
     emit('success', {'message': message}, room=user_id)
 
@@ -228,12 +297,15 @@ def send_success_notification(data):
 def reload_profile(data):
     '''' reloads profile of a user/friend '''
     friend = data.get('friend')
-    user_id = AUTH.authenticate_user().id
+    user = current_socket_user()
+    if user is None:
+        return
+    user_id = user.id
     if not friend:
         return
-    friend = db.find_user_by(username=friend)
-    if friend:
-        emit('profile reload', room=friend.id)
+    friend_id = db.get_user_id(friend)
+    if friend_id:
+        emit('profile reload', room=friend_id)
         emit('profile reload', room=user_id)
 
 
@@ -245,14 +317,16 @@ def reload_friend_section(data):
     print(friend)
 
     if friend:
-        friend_obj = db.find_user_by(username=friend)
-        if friend_obj:
-            friend_id = friend_obj.id
+        friend_id = db.get_user_id(friend)
+        if friend_id:
             emit('reload friend section', room=friend_id)
     return
 
 @socket_io.on('to reload userfriendList')
 def reload_user_friend_section():
     ''' reloads user friend section '''
-    user_id = AUTH.authenticate_user().id
+    user = current_socket_user()
+    if user is None:
+        return
+    user_id = user.id
     emit('reload user friend section', room=user_id)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+''' Socket.IO session context module
+The user behind a socket is authenticated once, when the socket connects,
+and kept in a per-sid context. Event handlers read the user from it instead
+of querying the database on every event.
+The contexts are local to a worker, the sids of every socket of a user are
+also registered in Redis by the presence service so any worker can end
+them.
+'''
+import threading
+from typing import Dict, List, Union
+from flask import request
+from flask_socketio import disconnect
+from redis.exceptions import RedisError
+from backend.api.v1.web_socket import socket_io
+from backend.db_ops import db
+from backend.db_ops.presence import presence
+
+
+class SocketUser:
+    ''' Identity of the authenticated user behind a socket
+    Only the id is kept for the life of the socket, the username is read
+    through the profile cache so a renamed user is seen under the new name
+    by every worker
+    '''
+    def __init__(self, user) -> None:
+        self.id = user.id
+
+    @property
+    def username(self) -> Union[str, None]:
+        ''' The current username of the user, None if the user is gone '''
+        profile = db.get_profile(self.id)
+        return profile['username'] if profile else None
+
+
+class SocketSessions:
+    ''' Maps the sids of the sockets connected to this worker to their
+    users
+    '''
+    def __init__(self) -> None:
+        self._users = {}
+        self._sids = {}
+        self._lock = threading.Lock()
+
+    def open(self, sid: str, user) -> SocketUser:
+        ''' Stores the context of a newly authenticated socket '''
+        socket_user = SocketUser(user)
+        with self._lock:
+            self._users[sid] = socket_user
+            self._sids.setdefault(socket_user.id, set()).add(sid)
+        presence.socket_opened(socket_user.id, sid)
+        return socket_user
+
+    def get(self, sid: str) -> Union[SocketUser, None]:
+        ''' Returns the user of a socket, None if it has no context '''
+        return self._users.get(sid)
+
+    def sockets(self) -> Dict[str, List[str]]:
+        ''' Returns the sids of the sockets connected to this worker by user
+        id
+        '''
+        with self._lock:
+            return {user_id: list(sids) for user_id, sids
+                    in self._sids.items()}
+
+    def close(self, sid: str) -> Union[SocketUser, None]:
+        ''' Drops the context of a socket
+        Return:
+            The user the socket belonged to
+        '''
+        with self._lock:
+            socket_user = self._users.pop(sid, None)
+            if socket_user is not None:
+                sids = self._sids.get(socket_user.id, set())
+                sids.discard(sid)
+                if not sids:
+                    self._sids.pop(socket_user.id, None)
+        if socket_user is not None:
+            try:
+                presence.socket_closed(socket_user.id, sid)
+            except RedisError as e:
+                print(f'Error: could not unregister socket {sid}: {e}')
+        return socket_user
+
+    def invalidate_user(self, user_id: str) -> List[str]:
+        ''' Drops the contexts of every socket of a user
+        Return:
+            The sids of the sockets, including those connected to other
+            workers
+        '''
+        with self._lock:
+            sids = set(self._sids.pop(user_id, set()))
+            for sid in sids:
+                self._users.pop(sid, None)
+        try:
+            # the sockets of other workers are unregistered by their worker
+            for sid in sids:
+                presence.socket_closed(user_id, sid)
+            sids.update(presence.sockets_of(user_id))
+        except RedisError as e:
+            print(f'Error: could not read the sockets of {user_id}: {e}')
+        return list(sids)
+
+
+socket_sessions = SocketSessions()
+
+
+def current_socket_user() -> Union[SocketUser, None]:
+    ''' Returns the user of the socket the current event was received on
+    Sockets without a context (e.g. after logout) are disconnected
+    '''
+    socket_user = socket_sessions.get(request.sid)
+    if socket_user is None:
+        disconnect()
+    return socket_user
+
+
+def end_user_sockets(user_id: str) -> None:
+    ''' Invalidates and disconnects the sockets of a user on logout or
+    account removal, sockets of other workers are disconnected through the
+    message queue
+    '''
+    for sid in socket_sessions.invalidate_user(user_id):
+        socket_io.server.disconnect(sid)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+''' Background tasks module
+Periodic maintenance run next to the Socket.IO server. Every worker starts
+the tasks, a Redis lock held for one interval makes sure a single worker of
+the deployment runs each round of the deployment wide ones.
+'''
+import os
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
+from backend.api.v1.web_socket import socket_io
+from backend.api.v1.web_socket.location import deliver_pending_locations
+from backend.api.v1.web_socket.sessions import socket_sessions
+from backend.db_ops import db
+from backend.db_ops.connections import get_redis_connection
+from backend.db_ops.location_store import location_store
+from backend.db_ops.presence import presence
+from backend.db_ops.redis import RedisClient
+from backend.db_ops.tracking_acl import tracking_acl
+from config import Config
+
+SWEEPER_LOCK_KEY = 'notifications:sweeper:lock'
+LAST_SEEN_LOCK_KEY = 'last_seen:flush:lock'
+PRESENCE_PRUNE_LOCK_KEY = 'presence:prune:lock'
+# Number of users whose expired sockets are pruned per batch
+PRESENCE_PRUNE_BATCH_SIZE = 500
+LOCATION_LOCK_KEY = 'locations:flush:lock'
+HISTORY_LOCK_KEY = 'location_history:downsample:lock'
+# Number of history buckets downsampled per bulk write
+HISTORY_DOWNSAMPLE_BATCH_SIZE = 200
+TRACKING_ACL_CHECK_INTERVAL = 30
+
+redis_client = RedisClient()
+
+
+def acquire_round(lock_key: str, interval: int) -> bool:
+    ''' Claims the current round of a periodic task for this worker '''
+    return bool(get_redis_connection().set(lock_key, os.getpid(), nx=True,
+                                           ex=interval))
+
+
+def notification_sweeper() -> None:
+    ''' Applies the notification retention policy every
+    NOTIFICATION_SWEEP_INTERVAL seconds
+    '''
+    interval = Config.NOTIFICATION_SWEEP_INTERVAL
+    while True:
+        socket_io.sleep(interval)
+        try:
+            if acquire_round(SWEEPER_LOCK_KEY, interval):
+                deleted = redis_client.sweep_notifications(
+                    Config.NOTIFICATION_RETENTION_DAYS,
+                    Config.NOTIFICATIONS_MAX_PER_USER,
+                    Config.NOTIFICATION_SWEEP_BATCH_SIZE)
+                if deleted:
+                    print(f'Swept {deleted} notifications')
+        except RedisError as e:
+            print(f'Error: notification sweep failed: {e}')
+
+
+def socket_heartbeat() -> None:
+    ''' Renews the sockets connected to this worker every
+    SOCKET_HEARTBEAT_INTERVAL seconds, then one worker of the deployment
+    prunes the sockets no worker renewed
+    '''
+    interval = Config.SOCKET_HEARTBEAT_INTERVAL
+    while True:
+        socket_io.sleep(interval)
+        try:
+            presence.renew_sockets(socket_sessions.sockets())
+            if acquire_round(PRESENCE_PRUNE_LOCK_KEY, interval):
+                while presence.prune_sockets(PRESENCE_PRUNE_BATCH_SIZE)\
+                        == PRESENCE_PRUNE_BATCH_SIZE:
+                    socket_io.sleep(0)
+        except RedisError as e:
+            print(f'Error: socket heartbeat failed: {e}')
+
+
+def broadcast_presence_changes() -> None:
+    ''' Sends the queued online status changes to the rooms of the friends
+    of the users, one event per friend
+    '''
+    changes = presence.pop_changes()
+    if not changes:
+        return
+    events = {}
+    for user_id, user in db.get_friend_ids(list(changes)).items():
+        change = dict(changes[user_id], username=user['username'])
+        for friend_id in user['friends']:
+            events.setdefault(friend_id, []).append(change)
+    for friend_id, friends in events.items():
+        socket_io.emit('presence', {'friends': friends}, room=friend_id)
+
+
+def presence_broadcaster() -> None:
+    ''' Broadcasts the online status changes every
+    PRESENCE_BROADCAST_INTERVAL seconds, a user going on and off within an
+    interval is only broadcast once
+    '''
+    while True:
+        socket_io.sleep(Config.PRESENCE_BROADCAST_INTERVAL)
+        try:
+            broadcast_presence_changes()
+        except (PyMongoError, RedisError) as e:
+            print(f'Error: presence broadcast failed: {e}')
+
+
+def flush_last_seen() -> int:
+    ''' Writes the pending last_seen times to MongoDB in batches
+    Return:
+        The number of users flushed
+    '''
+    flushed = 0
+    while True:
+        last_seen = presence.pop_dirty_last_seen(
+            Config.LAST_SEEN_FLUSH_BATCH_SIZE)
+        if not last_seen:
+            return flushed
+        try:
+            db.update_last_seen(last_seen)
+        except PyMongoError:
+            # keeps the times for the next round
+            presence.mark_last_seen_dirty(list(last_seen))
+            raise
+        # the flushed times are read from MongoDB from now on
+        presence.forget_last_seen(last_seen)
+        flushed += len(last_seen)
+
+
+def last_seen_flusher() -> None:
+    ''' Flushes the last_seen times every LAST_SEEN_FLUSH_INTERVAL seconds
+    '''
+    interval = Config.LAST_SEEN_FLUSH_INTERVAL
+    while True:
+        socket_io.sleep(interval)
+        try:
+            if acquire_round(LAST_SEEN_LOCK_KEY, interval):
+                flush_last_seen()
+        except (PyMongoError, RedisError) as e:
+            print(f'Error: last_seen flush failed: {e}')
+
+
+def flush_locations() -> int:
+    ''' Writes the locations updated since the last flush to MongoDB, one
+    bulk write per batch, and appends them to the location history
+    Return:
+        The number of users flushed
+    '''
+    batch_size = Config.LOCATION_FLUSH_BATCH_SIZE
+    flushed = 0
+    while True:
+        dirty = location_store.dirty(batch_size)
+        if not dirty:
+            return flushed
+        fixes = {user_id: [entry['location'], entry['score']]
+                 for user_id, entry in dirty.items() if entry['location']}
+        db.update_locations(fixes)
+        db.append_location_history(fixes)
+        cleaned = location_store.mark_flushed(dirty)
+        flushed += len(dirty)
+        # users moving again during the flush stay dirty for the next round
+        if len(dirty) < batch_size or not cleaned:
+            return flushed
+
+
+def location_flusher() -> None:
+    ''' Flushes the hot locations every LOCATION_FLUSH_INTERVAL seconds '''
+    interval = Config.LOCATION_FLUSH_INTERVAL
+    while True:
+        socket_io.sleep(interval)
+        try:
+            if acquire_round(LOCATION_LOCK_KEY, interval):
+                flush_locations()
+        except (PyMongoError, RedisError) as e:
+            print(f'Error: location flush failed: {e}')
+
+
+def location_trailer() -> None:
+    ''' Delivers the locations held back from subscribers every half
+    LOCATION_PUSH_INTERVAL_MS
+    '''
+    while True:
+        socket_io.sleep(Config.LOCATION_PUSH_INTERVAL_MS / 2000)
+        try:
+            deliver_pending_locations()
+        except RedisError as e:
+            print(f'Error: held back locations delivery failed: {e}')
+
+
+def history_downsampler() -> None:
+    ''' Downsamples the location history older than
+    LOCATION_HISTORY_DOWNSAMPLE_AFTER hours every
+    LOCATION_HISTORY_DOWNSAMPLE_INTERVAL seconds
+    '''
+    interval = Config.LOCATION_HISTORY_DOWNSAMPLE_INTERVAL
+    while True:
+        socket_io.sleep(interval)
+        try:
+            if not acquire_round(HISTORY_LOCK_KEY, interval):
+                continue
+            before = datetime.now(timezone.utc) - timedelta(
+                hours=Config.LOCATION_HISTORY_DOWNSAMPLE_AFTER)
+            while db.downsample_location_history(
+                    before, Config.LOCATION_HISTORY_DOWNSAMPLE_SECONDS,
+                    HISTORY_DOWNSAMPLE_BATCH_SIZE):
+                socket_io.sleep(0)
+        except PyMongoError as e:
+            print(f'Error: location history downsampling failed: {e}')
+
+
+def tracking_acl_keeper() -> None:
+    ''' Rebuilds the tracker sets from MongoDB whenever Redis lost them,
+    checked every TRACKING_ACL_CHECK_INTERVAL seconds
+    '''
+    while True:
+        try:
+            if tracking_acl.rebuild():
+                print('Rebuilt the tracker sets')
+        except (PyMongoError, RedisError) as e:
+            print(f'Error: tracker sets rebuild failed: {e}')
+        socket_io.sleep(TRACKING_ACL_CHECK_INTERVAL)
+
+
+def start_background_tasks() -> None:
+    ''' Starts the periodic tasks of the worker '''
+    if Config.NOTIFICATION_SWEEP_INTERVAL > 0:
+        socket_io.start_background_task(notification_sweeper)
+    socket_io.start_background_task(socket_heartbeat)
+    socket_io.start_background_task(presence_broadcaster)
+    socket_io.start_background_task(last_seen_flusher)
+    socket_io.start_background_task(location_flusher)
+    socket_io.start_background_task(location_trailer)
+    socket_io.start_background_task(history_downsampler)
+    socket_io.start_background_task(tracking_acl_keeper)
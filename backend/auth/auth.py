@@ -3,7 +3,7 @@
 from flask import request, abort
 from flask_login import current_user
 from typing import TypeVar, Union
-from backend.db_ops.database import DB
+from backend.db_ops import db
 
 OBJECT_TYPES = Union[TypeVar('User'), TypeVar('Conversation')]
 
@@ -11,7 +11,7 @@ OBJECT_TYPES = Union[TypeVar('User'), TypeVar('Conversation')]
 class Auth:
     ''' Authentication class '''
     def __init__(self) -> None:
-        self._db = DB()
+        self._db = db
 
     def authenticate_user(self):
         ''' Authenticates a user using the session_id stored in the set-cookie
@@ -87,12 +87,20 @@ class Auth:
         return x_token
 
     def update_password(self, reset_token: str, new_password: str) -> bool:
-        ''' Resets password of a valid user using a valid reset x_token '''
-        user = self._db.find_user_by(reset_token=reset_token)
-        if not user:
-            return False
-        self._db.update_user(user.id, _password=new_password, reset_token=None)
-        return True
+        ''' Resets password of a valid user using a valid reset x_token
+        The update only applies to the version of the user the token was
+        read from, a token is used once even by concurrent requests.
+        Unrelated writes in between (e.g. a location flush) are retried
+        '''
+        for _ in range(3):
+            user = self._db.find_user_by(reset_token=reset_token)
+            if not user:
+                return False
+            if self._db.update_user(user.id, expected_version=user.version,
+                                    _password=new_password,
+                                    reset_token=None):
+                return True
+        return False
 
     def is_valid_user_and_friend(self, user_id: str, friend_id: str):
         ''' Checks if user and friend exist in the database
@@ -151,16 +159,9 @@ class Auth:
         conversation = self._db.find_conversation_by(participants=participants)
         if not conversation:
             return False
-        user_name = self._db.find_user_by(id=user_id).username
-        messages = conversation.messages
-        if not messages:
-            return False
-        for message in messages.values():
-            if message.get('read') == False and\
-                    message.get('receiver') == user_name:
-                return True
-        return False
-    
+        last_received = conversation.last_received.get(user_id, 0)
+        return last_received > conversation.read_cursors.get(user_id, 0)
+
     def is_valid_email(self, email: str) -> bool:
         ''' Validates an email address
         Return:
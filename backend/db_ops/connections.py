@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+''' Shared database connections module
+A single MongoClient (and thus a single connection pool) is shared by every
+DB instance of a worker process. The client is created lazily and recreated
+after a fork, since a MongoClient must never be shared across processes.
+The Redis connection is shared the same way, redis-py resets its pool
+itself after a fork.
+'''
+import os
+import threading
+from collections import Counter
+from typing import Dict
+import redis
+from pymongo import MongoClient, monitoring
+from config import Config
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    ''' Counts the connection pool events of the current worker '''
+    def __init__(self) -> None:
+        self.counts = Counter()
+
+    def pool_created(self, event) -> None:
+        self.counts['pools_created'] += 1
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        self.counts['pools_cleared'] += 1
+
+    def pool_closed(self, event) -> None:
+        self.counts['pools_closed'] += 1
+
+    def connection_created(self, event) -> None:
+        self.counts['connections_created'] += 1
+        self.counts['connections_open'] += 1
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        self.counts['connections_closed'] += 1
+        self.counts['connections_open'] -= 1
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_check_out_failed(self, event) -> None:
+        self.counts['checkouts_failed'] += 1
+
+    def connection_checked_out(self, event) -> None:
+        self.counts['checkouts'] += 1
+        self.counts['connections_in_use'] += 1
+
+    def connection_checked_in(self, event) -> None:
+        self.counts['connections_in_use'] -= 1
+
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_pool_stats = PoolStats()
+_redis = None
+
+
+def get_mongo_client() -> MongoClient:
+    ''' Returns the MongoClient of the current process, creating it on first
+    use and after a fork
+    '''
+    global _client, _client_pid, _pool_stats
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _lock:
+        if _client is None or _client_pid != pid:
+            # the parent's client is unusable in a forked child, drop it
+            # without closing the parent's sockets
+            _pool_stats = PoolStats()
+            _client = MongoClient(
+                Config.MONGO_URI,
+                maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=Config.MONGO_MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=Config.MONGO_SOCKET_TIMEOUT_MS,
+                serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                compressors=Config.MONGO_COMPRESSORS,
+                event_listeners=[_pool_stats],
+                connect=False,
+            )
+            _client_pid = pid
+    return _client
+
+
+def mongo_connection_stats() -> Dict[str, int]:
+    ''' Returns the connection pool statistics of the current worker '''
+    stats = dict(_pool_stats.counts)
+    stats['pid'] = os.getpid()
+    stats['max_pool_size'] = Config.MONGO_MAX_POOL_SIZE
+    return stats
+
+
+def get_redis_connection() -> redis.StrictRedis:
+    ''' Returns the Redis connection shared by the whole process '''
+    global _redis
+
+    if _redis is None:
+        with _lock:
+            if _redis is None:
+                _redis = redis.StrictRedis.from_url(
+                    Config.REDIS_URL, decode_responses=True)
+    return _redis
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+''' Geofences module
+Users define named zones (home, school, ...) and are notified when a friend
+they track enters or leaves one. Zones are stored in the MongoDB geofences
+collection and indexed in Redis per owner:
+    geofences:{owner_id}      hash of the zone ids to their name and radius,
+                              with the `_loaded` marker once the zones of the
+                              owner are indexed
+    geofences:{owner_id}:geo  GEO set of the zone centers
+A location update only searches the GEO sets of the friends tracking the
+moving user, never every zone. The zones a user is inside are kept in
+geofence_state:{user_id} as owner_id:zone_id members so only transitions
+fire, a transition is only reported by the update whose SADD or SREM
+changed the state, so concurrent updates never report it twice. A user
+enters a zone within its radius and leaves it beyond the radius plus
+GEOFENCE_HYSTERESIS_METERS.
+'''
+import json
+from typing import Dict, List, Union
+from backend.db_ops import db
+from backend.db_ops.connections import get_redis_connection
+from backend.db_ops.location_store import is_valid_coordinates
+from backend.models.helpers import location_coordinates
+from config import Config
+
+LOADED_FIELD = '_loaded'
+MAX_NAME_LENGTH = 50
+
+
+def format_geofence(geofence: Dict) -> Dict:
+    ''' Returns a stored geofence in the API format, center as [lat, long] '''
+    return {'id': geofence['id'], 'name': geofence['name'],
+            'center': location_coordinates(geofence['center']),
+            'radius': geofence['radius']}
+
+
+class Geofences:
+    ''' Geofences of users and the zones tracked users are inside '''
+    def __init__(self) -> None:
+        ''' Initialize a new Geofences instance '''
+        self._redis_client = get_redis_connection()
+
+    @staticmethod
+    def _index(pipe, geofence: Dict) -> None:
+        ''' Queues the indexing of a stored geofence on a pipeline '''
+        owner_id = geofence['owner_id']
+        long, lat = geofence['center']['coordinates']
+        pipe.hset(f'geofences:{owner_id}', geofence['id'], json.dumps(
+            {'name': geofence['name'], 'radius': geofence['radius']}))
+        pipe.geoadd(f'geofences:{owner_id}:geo', [long, lat, geofence['id']])
+
+    def _load(self, owner_ids: List[str]) -> None:
+        ''' Indexes the geofences of the owners not indexed yet, read from
+        MongoDB in a single query
+        '''
+        pipe = self._redis_client.pipeline(transaction=False)
+        for owner_id in owner_ids:
+            pipe.hexists(f'geofences:{owner_id}', LOADED_FIELD)
+        missing = [owner_id for owner_id, loaded
+                   in zip(owner_ids, pipe.execute()) if not loaded]
+        if not missing:
+            return
+        pipe = self._redis_client.pipeline()
+        for geofence in db.get_geofences(missing):
+            self._index(pipe, geofence)
+        for owner_id in missing:
+            pipe.hset(f'geofences:{owner_id}', LOADED_FIELD, 1)
+        pipe.execute()
+
+    def add(self, owner_id: str, name: str, center: List[float],
+            radius: Union[int, float]) -> Union[Dict, None]:
+        ''' Creates a new geofence of a user, center is a [lat, long] pair
+        Return:
+            The geofence on success,
+            None if the geofence is invalid or the user reached
+            MAX_GEOFENCES_PER_USER
+        '''
+        if not isinstance(name, str) or not name.strip()\
+                or len(name) > MAX_NAME_LENGTH:
+            return None
+        if not is_valid_coordinates(center):
+            return None
+        if not isinstance(radius, (int, float)) or isinstance(radius, bool)\
+                or not Config.GEOFENCE_MIN_RADIUS <= radius\
+                <= Config.GEOFENCE_MAX_RADIUS:
+            return None
+        if db.count_geofences(owner_id) >= Config.MAX_GEOFENCES_PER_USER:
+            return None
+
+        geofence = db.add_geofence(owner_id, name.strip(), center, radius)
+        if geofence is None:
+            return None
+        pipe = self._redis_client.pipeline()
+        self._index(pipe, geofence)
+        pipe.execute()
+        return format_geofence(geofence)
+
+    def get(self, owner_id: str) -> List[Dict]:
+        ''' Returns the geofences of a user '''
+        return [format_geofence(geofence)
+                for geofence in db.get_geofences([owner_id])]
+
+    def delete(self, owner_id: str, geofence_id: str) -> bool:
+        ''' Deletes a geofence of a user, the users inside it drop it from
+        their state on their next location update
+        '''
+        if not db.delete_geofences(owner_id, geofence_id):
+            return False
+        pipe = self._redis_client.pipeline()
+        pipe.hdel(f'geofences:{owner_id}', geofence_id)
+        pipe.zrem(f'geofences:{owner_id}:geo', geofence_id)
+        pipe.execute()
+        return True
+
+    def delete_all(self, owner_id: str) -> None:
+        ''' Deletes every geofence of a user and the zones the user is
+        recorded inside, e.g. when the user is removed
+        '''
+        db.delete_geofences(owner_id)
+        self._redis_client.delete(f'geofences:{owner_id}',
+                                  f'geofences:{owner_id}:geo',
+                                  f'geofence_state:{owner_id}')
+
+    def transitions(self, user_id: str, tracker_ids: List[str],
+                    location: List[float]) -> List[Dict]:
+        ''' Records the new location of a user against the geofences of the
+        friends tracking the user, location is a [lat, long] pair
+        Return:
+            The zones entered or left, in the format
+            [{'owner_id': ..., 'zone': name, 'entered': bool}]
+        '''
+        state_key = f'geofence_state:{user_id}'
+        if not tracker_ids:
+            self._redis_client.delete(state_key)
+            return []
+        self._load(tracker_ids)
+
+        # zones are at most GEOFENCE_MAX_RADIUS wide, anything further than
+        # that plus the hysteresis is outside every zone
+        lat, long = location
+        search_radius = Config.GEOFENCE_MAX_RADIUS\
+            + Config.GEOFENCE_HYSTERESIS_METERS
+        pipe = self._redis_client.pipeline(transaction=False)
+        for owner_id in tracker_ids:
+            pipe.geosearch(f'geofences:{owner_id}:geo', longitude=long,
+                           latitude=lat, radius=search_radius, unit='m',
+                           withdist=True)
+        pipe.smembers(state_key)
+        *results, inside = pipe.execute()
+
+        distances = {}
+        for owner_id, zones in zip(tracker_ids, results):
+            for zone_id, distance in zones:
+                distances[f'{owner_id}:{zone_id}'] = float(distance)
+
+        # names and radii of the nearby zones and of the zones left
+        members = list(set(distances) | inside)
+        pipe = self._redis_client.pipeline(transaction=False)
+        for member in members:
+            owner_id, zone_id = member.split(':', 1)
+            pipe.hget(f'geofences:{owner_id}', zone_id)
+        zones = dict(zip(members, pipe.execute()))
+
+        entered, left, dropped = [], [], []
+        trackers = set(tracker_ids)
+        for member in members:
+            owner_id = member.split(':', 1)[0]
+            zone = zones[member]
+            if zone is None or owner_id not in trackers:
+                # deleted zone or friend no longer tracking the user
+                if member in inside:
+                    dropped.append(member)
+                continue
+            zone = json.loads(zone)
+            distance = distances.get(member)
+            if member not in inside:
+                if distance is not None and distance <= zone['radius']:
+                    entered.append((member, zone))
+            elif distance is None or distance > zone['radius']\
+                    + Config.GEOFENCE_HYSTERESIS_METERS:
+                left.append((member, zone))
+
+        # one command per member in a transaction, its result tells whether
+        # this update made the transition
+        transitions = [(member, zone, True) for member, zone in entered]\
+            + [(member, zone, False) for member, zone in left]
+        pipe = self._redis_client.pipeline()
+        for member, _, is_entered in transitions:
+            if is_entered:
+                pipe.sadd(state_key, member)
+            else:
+                pipe.srem(state_key, member)
+        if dropped:
+            pipe.srem(state_key, *dropped)
+        changed = pipe.execute()
+
+        return [{'owner_id': member.split(':', 1)[0], 'zone': zone['name'],
+                 'entered': is_entered}
+                for (member, zone, is_entered), is_changed
+                in zip(transitions, changed) if is_changed == 1]
+
+
+geofences = Geofences()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+''' Request scoped identity map module
+Keeps the users and conversations loaded while handling a request (or a
+Socket.IO event) so repeated lookups of the same object are served from
+memory instead of MongoDB. The maps live on flask.g and are dropped with the
+app context at teardown.
+'''
+from copy import deepcopy
+from typing import Any, Tuple, Union
+from flask import g, has_app_context
+
+USER_KEYS = ('id', 'username', 'email', 'session_id')
+CONVERSATION_KEYS = ('id', 'participant_key')
+
+# Lookups served from identity maps (i.e. database round trips saved) and
+# lookups that had to go to the database, since the worker started
+stats = {'hits': 0, 'misses': 0}
+
+
+class IdentityMap:
+    ''' Maps every lookup key of the loaded objects to the object '''
+    def __init__(self, keys: Tuple[str, ...]) -> None:
+        self._keys = keys
+        self._objects = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, value: Any) -> Union[Any, None]:
+        ''' Returns a copy of the object loaded with key == value, copies
+        keep callers mutating an object from altering the map
+        '''
+        if key not in self._keys:
+            return None
+        obj = self._objects.get((key, value))
+        if obj is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return deepcopy(obj)
+
+    def add(self, obj: Any) -> None:
+        ''' Adds (or refreshes) a loaded object under all its lookup keys '''
+        self.discard('id', obj.id)
+        obj = deepcopy(obj)
+        for key in self._keys:
+            value = getattr(obj, key, None)
+            if value is not None:
+                self._objects[(key, value)] = obj
+
+    def discard(self, key: str, value: Any) -> None:
+        ''' Removes the object loaded with key == value from the map '''
+        obj = self._objects.get((key, value))
+        if obj is None:
+            return
+        self._objects = {lookup: cached for lookup, cached in
+                         self._objects.items() if cached is not obj}
+
+
+def _identity_map(name: str, keys: Tuple[str, ...])\
+        -> Union[IdentityMap, None]:
+    ''' Returns the identity map of the current app context, None outside of
+    a request or Socket.IO event
+    '''
+    if not has_app_context():
+        return None
+    identity_map = g.get(name)
+    if identity_map is None:
+        identity_map = IdentityMap(keys)
+        setattr(g, name, identity_map)
+    return identity_map
+
+
+def user_map() -> Union[IdentityMap, None]:
+    ''' Returns the users identity map of the current request '''
+    return _identity_map('_user_map', USER_KEYS)
+
+
+def conversation_map() -> Union[IdentityMap, None]:
+    ''' Returns the conversations identity map of the current request '''
+    return _identity_map('_conversation_map', CONVERSATION_KEYS)
+
+
+def clear() -> None:
+    ''' Drops the identity maps of the current request and adds their
+    counters to the worker stats
+    '''
+    for name in ('_user_map', '_conversation_map'):
+        identity_map = g.pop(name, None)
+        if identity_map is not None:
+            stats['hits'] += identity_map.hits
+            stats['misses'] += identity_map.misses
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+''' Database indexes module
+Declares the indexes every hot query relies on. They are created at worker
+startup and can be created or checked from the command line with:
+    python3 -m backend.db_ops.indexes [--check]
+'''
+import sys
+from typing import Dict, List
+from pymongo import ASCENDING, GEOSPHERE, IndexModel
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+from config import Config
+
+# Users with at least one friend tracking them, any non-empty map sorts
+# after the empty one. The partial index of these users serves the tracker
+# sets rebuild
+TRACKED_USERS_FILTER = {'tracking_me': {'$gt': {}}}
+TRACKED_USERS_INDEX = 'tracked_users'
+
+INDEXES = {
+    'users': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+        IndexModel([('username', ASCENDING)], name='username_unique',
+                   unique=True),
+        IndexModel([('session_id', ASCENDING)], name='session_id'),
+        IndexModel([('reset_token', ASCENDING)], name='reset_token'),
+        IndexModel([('location', GEOSPHERE)], name='location_2dsphere'),
+        IndexModel([('id', ASCENDING)], name=TRACKED_USERS_INDEX,
+                   partialFilterExpression=TRACKED_USERS_FILTER),
+    ],
+    'conversations': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('participant_key', ASCENDING)],
+                   name='participant_key_unique', unique=True, sparse=True),
+        IndexModel([('participants', ASCENDING)], name='participants'),
+    ],
+    'message_buckets': [
+        IndexModel([('conversation_id', ASCENDING), ('bucket', ASCENDING)],
+                   name='conversation_bucket_unique', unique=True),
+    ],
+    'location_history': [
+        IndexModel([('user_id', ASCENDING), ('bucket', ASCENDING)],
+                   name='user_bucket_unique', unique=True),
+        # drops the buckets older than the retention
+        IndexModel([('bucket', ASCENDING)], name='bucket_ttl',
+                   expireAfterSeconds=Config.LOCATION_HISTORY_RETENTION_DAYS
+                   * 86400),
+        IndexModel([('downsampled', ASCENDING), ('bucket', ASCENDING)],
+                   name='downsampled_bucket'),
+    ],
+    'geofences': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('owner_id', ASCENDING)], name='owner_id'),
+    ],
+}
+
+# Representative filters of the queries issued by the DB class, every one of
+# them must be answered by an index. A third item names the index the query
+# hints
+QUERY_SHAPES = {
+    'find_user_by(id)': ('users', {'id': 'x'}),
+    'find_user_by(email)': ('users', {'email': 'x'}),
+    'find_user_by(username)': ('users', {'username': 'x'}),
+    'find_user_by(session_id)': ('users', {'session_id': 'x'}),
+    'find_user_by(reset_token)': ('users', {'reset_token': 'x'}),
+    'get_locations': ('users', {'id': {'$in': ['x', 'y']}}),
+    'get_friend_ids': ('users', {'id': {'$in': ['x', 'y']}}),
+    'update_last_seen': ('users', {'id': {'$in': ['x', 'y']},
+                                   'friends.z': {'$exists': True}}),
+    'iter_tracking_me': ('users', TRACKED_USERS_FILTER, TRACKED_USERS_INDEX),
+    'find_conversation_by(id)': ('conversations', {'id': 'x'}),
+    'find_conversation_by(participants)': (
+        'conversations', {'participant_key': 'x:y'}),
+    'get_inbox': ('conversations', {'participants': 'x'}),
+    'get_unread_counts': ('conversations', {'participants': 'x'}),
+    'get_messages': ('message_buckets', {'conversation_id': 'x'}),
+    'update_message': ('message_buckets',
+                       {'conversation_id': 'x', 'messages.id': 'y'}),
+    'get_location_history': ('location_history', {'user_id': 'x'}),
+    'downsample_location_history': ('location_history',
+                                    {'downsampled': False}),
+    'get_geofences': ('geofences', {'owner_id': {'$in': ['x', 'y']}}),
+}
+
+
+class IndexCreationError(Exception):
+    ''' Raised when required indexes (the unique ones, correctness depends
+    on them) could not be created
+    '''
+    def __init__(self, failed: Dict[str, Dict[str, str]]) -> None:
+        self.failed = failed
+        names = ', '.join(f'{collection_name}.{name}'
+                          for collection_name, errors in failed.items()
+                          for name in errors)
+        super().__init__(f'Required indexes missing: {names}')
+
+
+def ensure_indexes(database: Database) -> Dict[str, List[str]]:
+    ''' Creates the declared indexes one by one, indexes that already exist
+    are left untouched. An index that cannot be created (e.g. duplicate keys
+    for a unique index) is reported and does not prevent the others
+    Raise:
+        IndexCreationError if a unique index could not be created
+    Return:
+        The names of the indexes created per collection
+    '''
+    created = {}
+    required = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = database[collection_name]
+        for index in indexes:
+            name = index.document['name']
+            try:
+                collection.create_indexes([index])
+            except OperationFailure as e:
+                print(f'Error: could not create index {name} on '
+                      f'{collection_name}: {e}')
+                if index.document.get('unique'):
+                    required.setdefault(collection_name, {})[name] = str(e)
+                continue
+            created.setdefault(collection_name, []).append(name)
+    if required:
+        raise IndexCreationError(required)
+    return created
+
+
+def missing_indexes(database: Database) -> Dict[str, List[str]]:
+    ''' Returns the declared indexes not present in the database per
+    collection
+    '''
+    missing = {}
+    for collection_name, indexes in INDEXES.items():
+        existing = database[collection_name].index_information()
+        names = [index.document['name'] for index in indexes
+                 if index.document['name'] not in existing]
+        if names:
+            missing[collection_name] = names
+    return missing
+
+
+def uses_index(collection: Collection, query: Dict, hint: str = None)\
+        -> bool:
+    ''' Verifies with explain() that a query, hinting the given index if
+    any, is not answered by a collection scan
+    '''
+    cursor = collection.find(query)
+    if hint is not None:
+        cursor = cursor.hint(hint)
+    plan = cursor.explain()['queryPlanner']['winningPlan']
+    stages = [plan]
+    while stages:
+        stage = stages.pop()
+        if stage.get('stage') == 'COLLSCAN':
+            return False
+        if 'inputStage' in stage:
+            stages.append(stage['inputStage'])
+        stages.extend(stage.get('inputStages', []))
+    return True
+
+
+def unindexed_queries(database: Database) -> List[str]:
+    ''' Returns the names of the query shapes answered by a collection scan
+    '''
+    return [name for name, (collection_name, query, *hint)
+            in QUERY_SHAPES.items()
+            if not uses_index(database[collection_name], query, *hint)]
+
+
+if __name__ == '__main__':
+    from backend.db_ops import db
+
+    if '--check' in sys.argv:
+        missing = missing_indexes(db.database)
+        for collection_name, names in missing.items():
+            print(f'Missing on {collection_name}: {", ".join(names)}')
+        unindexed = unindexed_queries(db.database)
+        for name in unindexed:
+            print(f'Collection scan: {name}')
+        sys.exit(1 if missing or unindexed else 0)
+
+    try:
+        for collection_name, names in ensure_indexes(db.database).items():
+            print(f'{collection_name}: {", ".join(names)}')
+    except (IndexCreationError, OperationFailure) as e:
+        print(f'Error: {e}')
+        sys.exit(1)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+''' Hot location store module
+The latest location of every user sharing it is kept in the Redis GEO set
+`locations`. Updates closer than LOCATION_MIN_MOVE_METERS to the stored
+location are dropped. Stored updates mark the user in the `locations:dirty`
+sorted set, scored with the time of the update in milliseconds, until a
+background flush writes the locations to MongoDB in batches.
+Locations are [latitude, longitude] pairs, as sent by the clients.
+'''
+import math
+import time
+from typing import Dict, List, Union
+from backend.db_ops.connections import get_redis_connection
+from config import Config
+
+LOCATIONS_KEY = 'locations'
+DIRTY_LOCATIONS_KEY = 'locations:dirty'
+
+# Removes flushed users from the dirty set, unless they moved again since
+# the flush read their location, i.e. their score or the geohash of their
+# location changed. ARGV holds user id, score, geohash triples
+CLEAN_SCRIPT = '''
+local cleaned = 0
+for i = 1, #ARGV, 3 do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    local geohash = redis.call('GEOHASH', KEYS[2], ARGV[i])[1] or ''
+    if score and tonumber(score) == tonumber(ARGV[i + 1])
+            and geohash == ARGV[i + 2] then
+        cleaned = cleaned + redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return cleaned
+'''
+
+
+def distance_meters(location1: List[float], location2: List[float]) -> float:
+    ''' Returns the great circle distance between two [lat, long] pairs '''
+    lat1, long1 = map(math.radians, location1)
+    lat2, long2 = map(math.radians, location2)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2)\
+        * math.sin((long2 - long1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+def is_valid_coordinates(location) -> bool:
+    ''' Verifies if a location is a [lat, long] pair Redis GEO accepts '''
+    if not isinstance(location, (list, tuple)) or len(location) != 2:
+        return False
+    if not all(isinstance(x, (int, float)) and not isinstance(x, bool)
+               for x in location):
+        return False
+    lat, long = location
+    return -85.05112878 <= lat <= 85.05112878 and -180 <= long <= 180
+
+
+class LocationStore:
+    ''' Latest locations of users, flushed to MongoDB behind the writes '''
+    def __init__(self) -> None:
+        ''' Initialize a new LocationStore instance '''
+        self._redis_client = get_redis_connection()
+        self._clean = self._redis_client.register_script(CLEAN_SCRIPT)
+        self.suppressed = 0
+        self.last_flush = {'at': None, 'count': 0, 'lag_ms': 0}
+
+    def get(self, user_id: str) -> Union[List[float], None]:
+        ''' Returns the latest location of a user, None if it is not in the
+        store
+        '''
+        position = self._redis_client.geopos(LOCATIONS_KEY, user_id)[0]
+        if position is None:
+            return None
+        long, lat = position
+        return [lat, long]
+
+    def get_many(self, user_ids: List[str])\
+            -> Dict[str, Union[List[float], None]]:
+        ''' Returns the latest locations of the given users '''
+        if not user_ids:
+            return {}
+        positions = self._redis_client.geopos(LOCATIONS_KEY, *user_ids)
+        return {user_id: [position[1], position[0]] if position else None
+                for user_id, position in zip(user_ids, positions)}
+
+    def update(self, user_id: str, location: List[float]) -> bool:
+        ''' Stores the new location of a user unless it is closer than
+        LOCATION_MIN_MOVE_METERS to the stored one
+        Return:
+            True if the location was stored, False if it was dropped
+        '''
+        previous = self.get(user_id)
+        if previous is not None and distance_meters(previous, location)\
+                < Config.LOCATION_MIN_MOVE_METERS:
+            self.suppressed += 1
+            return False
+
+        lat, long = location
+        pipe = self._redis_client.pipeline()
+        pipe.geoadd(LOCATIONS_KEY, [long, lat, user_id])
+        pipe.zadd(DIRTY_LOCATIONS_KEY, {user_id: int(time.time() * 1000)})
+        pipe.execute()
+        return True
+
+    def remove(self, user_id: str) -> int:
+        ''' Drops the location of a user, e.g. when the user turns it off
+        Return:
+            The time of the removal in milliseconds, later than the last
+            update of the user, to stamp the removal in MongoDB with
+        '''
+        pipe = self._redis_client.pipeline()
+        pipe.zscore(DIRTY_LOCATIONS_KEY, user_id)
+        pipe.zrem(LOCATIONS_KEY, user_id)
+        pipe.zrem(DIRTY_LOCATIONS_KEY, user_id)
+        updated_at = pipe.execute()[0]
+        removed_at = int(time.time() * 1000)
+        if updated_at is not None:
+            removed_at = max(removed_at, int(updated_at) + 1)
+        return removed_at
+
+    def dirty(self, count: int) -> Dict[str, Dict]:
+        ''' Returns up to count locations not flushed to MongoDB yet, oldest
+        updates first, in the format
+        {id: {'location': ..., 'score': ..., 'geohash': ...}}
+        '''
+        entries = self._redis_client.zrange(DIRTY_LOCATIONS_KEY, 0, count - 1,
+                                            withscores=True)
+        if not entries:
+            return {}
+        user_ids = [user_id for user_id, _ in entries]
+        pipe = self._redis_client.pipeline()
+        pipe.geopos(LOCATIONS_KEY, *user_ids)
+        pipe.geohash(LOCATIONS_KEY, *user_ids)
+        positions, geohashes = pipe.execute()
+        return {user_id: {'location': [position[1], position[0]]
+                          if position else None,
+                          'score': score, 'geohash': geohash or ''}
+                for (user_id, score), position, geohash
+                in zip(entries, positions, geohashes)}
+
+    def mark_flushed(self, flushed: Dict[str, Dict]) -> int:
+        ''' Removes the flushed locations from the dirty set and records
+        the flush metrics
+        Return:
+            The number of users cleaned
+        '''
+        args = []
+        for user_id, entry in flushed.items():
+            args.extend([user_id, repr(int(entry['score'])),
+                         entry['geohash']])
+        cleaned = self._clean(keys=[DIRTY_LOCATIONS_KEY, LOCATIONS_KEY],
+                              args=args)
+        now = int(time.time() * 1000)
+        oldest = min(entry['score'] for entry in flushed.values())
+        self.last_flush = {'at': now, 'count': len(flushed),
+                           'lag_ms': now - int(oldest)}
+        return cleaned
+
+    def stats(self) -> Dict[str, Union[int, Dict]]:
+        ''' Returns the flush lag metrics of the store, the lag is the age
+        of the oldest location not flushed to MongoDB yet
+        '''
+        pending = self._redis_client.zcard(DIRTY_LOCATIONS_KEY)
+        oldest = self._redis_client.zrange(DIRTY_LOCATIONS_KEY, 0, 0,
+                                           withscores=True)
+        lag_ms = int(time.time() * 1000 - oldest[0][1]) if oldest else 0
+        return {'pending': pending, 'flush_lag_ms': lag_ms,
+                'suppressed': self.suppressed,
+                'last_flush': self.last_flush}
+
+
+location_store = LocationStore()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+''' Database migrations module
+Pending migrations are applied in order with:
+    python3 -m backend.db_ops.migrations
+Every applied migration is recorded in the migrations collection so running
+the command again only applies the new ones.
+'''
+from datetime import datetime
+from typing import Callable, List
+from pymongo.database import Database
+from backend.db_ops.database import PREVIEW_LENGTH, bucket_of
+from backend.db_ops.profile_cache import profile_cache
+from backend.models.helpers import LOCATION_FORMAT, make_participant_key
+
+MIGRATIONS = []
+
+
+def migration(func: Callable) -> Callable:
+    ''' Registers a migration function, migrations run in the order they are
+    registered
+    '''
+    MIGRATIONS.append(func)
+    return func
+
+
+@migration
+def move_messages_to_buckets(database: Database) -> None:
+    ''' Moves the messages embedded in conversation documents into message
+    buckets, numbering them in the order they were stored
+    '''
+    conversations = database.conversations.find(
+        {'messages': {'$exists': True}},
+        {'_id': 0, 'id': 1, 'messages': 1, 'message_count': 1})
+
+    for conversation in conversations:
+        seq = conversation.get('message_count', 0)
+        buckets = {}
+        for message in (conversation.get('messages') or {}).values():
+            seq += 1
+            message['seq'] = seq
+            buckets.setdefault(bucket_of(seq), []).append(message)
+
+        for bucket, messages in buckets.items():
+            database.message_buckets.update_one(
+                {'conversation_id': conversation['id'], 'bucket': bucket},
+                {'$push': {'messages': {'$each': messages}},
+                 '$inc': {'count': len(messages)}},
+                upsert=True
+            )
+        database.conversations.update_one(
+            {'id': conversation['id']},
+            {'$set': {'message_count': seq}, '$unset': {'messages': 1}}
+        )
+
+
+def merge_conversations(database: Database, kept_id: str,
+                        duplicate_id: str) -> None:
+    ''' Moves the messages of a duplicate conversation into the kept
+    conversation between the same users, then deletes the duplicate. The
+    messages of both are renumbered in the order they were created
+    '''
+    ids = [kept_id, duplicate_id]
+    messages = []
+    for bucket in database.message_buckets.find(
+            {'conversation_id': {'$in': ids}}, {'_id': 0, 'messages': 1}):
+        messages.extend(bucket.get('messages') or [])
+    messages.sort(key=lambda msg: (msg.get('created_at') or '',
+                                   msg.get('seq', 0)))
+
+    buckets = {}
+    for seq, message in enumerate(messages, 1):
+        message['seq'] = seq
+        buckets.setdefault(bucket_of(seq), []).append(message)
+    # the kept buckets are replaced before the duplicate ones are deleted,
+    # an interrupted merge never loses messages
+    for bucket, bucket_messages in buckets.items():
+        database.message_buckets.replace_one(
+            {'conversation_id': kept_id, 'bucket': bucket},
+            {'conversation_id': kept_id, 'bucket': bucket,
+             'messages': bucket_messages, 'count': len(bucket_messages)},
+            upsert=True)
+    database.message_buckets.delete_many(
+        {'conversation_id': kept_id, 'bucket': {'$nin': list(buckets)}})
+    database.conversations.update_one(
+        {'id': kept_id}, {'$set': {'message_count': len(messages)}})
+    database.message_buckets.delete_many({'conversation_id': duplicate_id})
+    database.conversations.delete_one({'id': duplicate_id})
+
+
+@migration
+def add_participant_keys(database: Database) -> None:
+    ''' Backfills the canonical participant key of conversations
+    Duplicate conversations between the same users are merged into the
+    oldest one, the one holding the key
+    '''
+    conversations = database.conversations.find(
+        {'participant_key': {'$exists': False}},
+        {'_id': 1, 'id': 1, 'participants': 1}).sort('_id', 1)
+
+    kept = {conversation['participant_key']: conversation['id']
+            for conversation in database.conversations.find(
+                {'participant_key': {'$type': 'string'}},
+                {'_id': 0, 'id': 1, 'participant_key': 1})}
+    for conversation in conversations:
+        key = make_participant_key(conversation.get('participants') or [])
+        if key in kept:
+            merge_conversations(database, kept[key], conversation['id'])
+            continue
+        kept[key] = conversation['id']
+        database.conversations.update_one(
+            {'_id': conversation['_id']}, {'$set': {'participant_key': key}})
+
+
+@migration
+def replace_read_flags_with_cursors(database: Database) -> None:
+    ''' Derives the per participant read cursors of conversations from the
+    read flags of their messages, then drops the flags
+    A participant's cursor stops before the oldest message they have not
+    read
+    '''
+    conversations = database.conversations.find(
+        {}, {'_id': 0, 'id': 1, 'participants': 1, 'message_count': 1})
+
+    for conversation in conversations:
+        participants = conversation.get('participants') or []
+        names = {user['username']: user['id'] for user in database.users.find(
+            {'id': {'$in': participants}}, {'_id': 0, 'id': 1, 'username': 1})}
+
+        last_received = {}
+        oldest_unread = {}
+        buckets = database.message_buckets.find(
+            {'conversation_id': conversation['id']},
+            {'_id': 0, 'messages.seq': 1, 'messages.receiver': 1,
+             'messages.read': 1})
+        for bucket in buckets:
+            for message in bucket.get('messages', []):
+                user_id = names.get(message.get('receiver'))
+                if user_id is None:
+                    continue
+                seq = message['seq']
+                last_received[user_id] = max(last_received.get(user_id, 0),
+                                             seq)
+                if message.get('read') is False:
+                    oldest_unread[user_id] = min(
+                        oldest_unread.get(user_id, seq), seq)
+
+        updates = {}
+        for user_id in names.values():
+            received = last_received.get(user_id, 0)
+            updates[f'last_received.{user_id}'] = received
+            updates[f'read_cursors.{user_id}'] = oldest_unread.get(
+                user_id, received + 1) - 1
+        if updates:
+            database.conversations.update_one(
+                {'id': conversation['id']}, {'$set': updates})
+
+    database.message_buckets.update_many(
+        {}, {'$unset': {'messages.$[].read': 1}})
+
+
+@migration
+def add_inbox_summaries(database: Database) -> None:
+    ''' Derives the unread counts and the last message preview of existing
+    conversations from their messages and read cursors
+    '''
+    conversations = database.conversations.find(
+        {}, {'_id': 0, 'id': 1, 'participants': 1, 'read_cursors': 1})
+
+    for conversation in conversations:
+        participants = conversation.get('participants') or []
+        names = {user['username']: user['id'] for user in database.users.find(
+            {'id': {'$in': participants}}, {'_id': 0, 'id': 1, 'username': 1})}
+        read_cursors = conversation.get('read_cursors') or {}
+
+        unread_counts = {user_id: 0 for user_id in names.values()}
+        last_message = None
+        buckets = database.message_buckets.find(
+            {'conversation_id': conversation['id']},
+            {'_id': 0, 'messages': 1})
+        for bucket in buckets:
+            for message in bucket.get('messages', []):
+                user_id = names.get(message.get('receiver'))
+                if user_id is not None\
+                        and message['seq'] > read_cursors.get(user_id, 0):
+                    unread_counts[user_id] += 1
+                if last_message is None\
+                        or message['seq'] > last_message['seq']:
+                    last_message = message
+
+        updates = {'unread_counts': unread_counts}
+        if last_message is not None:
+            content = last_message.get('content') or ''
+            updates['last_message'] = {
+                'sender': last_message.get('sender'),
+                'content': content[:PREVIEW_LENGTH],
+                'content_type': last_message.get('content_type'),
+                'seq': last_message['seq'],
+                'created_at': last_message.get('created_at'),
+            }
+            created_at = last_message.get('created_at')
+            try:
+                updates['last_message_at'] = datetime.strptime(
+                    created_at, '%Y-%m-%d %H:%M')
+            except (TypeError, ValueError):
+                updates['last_message_at'] = None
+        database.conversations.update_one(
+            {'id': conversation['id']}, {'$set': updates})
+
+
+@migration
+def drop_is_in_chat(database: Database) -> None:
+    ''' Drops the chat presence flags of conversations, presence is kept in
+    Redis
+    '''
+    database.conversations.update_many(
+        {'is_in_chat': {'$exists': True}}, {'$unset': {'is_in_chat': 1}})
+
+
+@migration
+def swap_location_coordinates(database: Database) -> None:
+    ''' Swaps the coordinates of the stored locations from [lat, long] to
+    the [long, lat] order of GeoJSON. Empty locations become null, the
+    2dsphere index of the locations rejects them. Swapped users are marked
+    with LOCATION_FORMAT, like every user the app writes a location of, so
+    running the migration again never swaps them back
+    The copies embedded in allowed_tracks are then rebuilt from the
+    locations of the users they copy, whichever order they were written in
+    '''
+    def swap(location):
+        coordinates = (location or {}).get('coordinates')
+        if not isinstance(coordinates, list) or len(coordinates) != 2:
+            return None
+        lat, long = coordinates
+        return {'type': 'Point', 'coordinates': [long, lat]}
+
+    users = database.users.find(
+        {'location_format': {'$ne': LOCATION_FORMAT}},
+        {'_id': 0, 'id': 1, 'location': 1})
+    for user in users:
+        database.users.update_one(
+            {'id': user['id'], 'location_format': {'$ne': LOCATION_FORMAT}},
+            {'$set': {'location': swap(user.get('location')),
+                      'location_format': LOCATION_FORMAT}})
+        profile_cache.invalidate(user['id'])
+
+    trackers = database.users.find(
+        {'allowed_tracks': {'$gt': {}}}, {'_id': 0, 'id': 1,
+                                          'allowed_tracks': 1})
+    for tracker in trackers:
+        tracked_ids = list(tracker['allowed_tracks'])
+        locations = {user['id']: user.get('location')
+                     for user in database.users.find(
+                         {'id': {'$in': tracked_ids}},
+                         {'_id': 0, 'id': 1, 'location': 1})}
+        database.users.update_one(
+            {'id': tracker['id']},
+            {'$set': {f'allowed_tracks.{user_id}.location':
+                      locations.get(user_id) for user_id in tracked_ids}})
+
+
+def run_migrations(database: Database) -> List[str]:
+    ''' Applies every migration that has not been applied yet
+    Return:
+        The names of the migrations applied
+    '''
+    applied = {doc['name'] for doc in database.migrations.find({}, {'name': 1})}
+    newly_applied = []
+    for func in MIGRATIONS:
+        if func.__name__ in applied:
+            continue
+        func(database)
+        database.migrations.insert_one({'name': func.__name__})
+        newly_applied.append(func.__name__)
+    return newly_applied
+
+
+if __name__ == '__main__':
+    from backend.db_ops import db
+
+    names = run_migrations(db.database)
+    if names:
+        for name in names:
+            print(f'Applied {name}')
+    else:
+        print('No pending migrations')
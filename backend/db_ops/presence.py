@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+''' Presence module
+Keeps which friend's chat each user currently has open in Redis, under
+in_chat:{user_id} -> friend id. Entries expire PRESENCE_TTL seconds after
+the last heartbeat of the client, so a closed tab clears itself even when
+its socket did not disconnect cleanly.
+A user is online while Redis holds live sids in presence:sockets:{user_id},
+the sorted set of their sockets on every worker scored by the time their
+registration expires. Each worker renews the sids of its sockets every
+SOCKET_HEARTBEAT_INTERVAL seconds, so the sockets of a crashed worker expire
+after SOCKET_TTL seconds and are pruned. presence:online scores the users
+with registered sockets by their latest expiry, it tells the pruner which
+users to check.
+Going offline records the time in the last_seen hash and marks the user in
+last_seen:dirty until the time is flushed to MongoDB, flushed times are
+dropped from the hash. Online status changes are queued in the
+presence:changes hash, where any worker pops them to broadcast to friends in
+batches.
+'''
+import json
+import time
+from datetime import datetime
+from typing import Dict, List, Union
+from backend.db_ops.connections import get_redis_connection
+from config import Config
+
+LAST_SEEN_KEY = 'last_seen'
+DIRTY_LAST_SEEN_KEY = 'last_seen:dirty'
+ONLINE_KEY = 'presence:online'
+CHANGES_KEY = 'presence:changes'
+
+# Deletes the presence of a user only if it still is the given chat, a newer
+# chat opened in the meantime is kept
+CLEAR_CHAT_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+# Shared by the socket scripts, KEYS are the sockets of a user, the online
+# users, the queued changes, the last_seen hash and the dirty set
+PRESENCE_HELPERS = '''
+local function go_offline(user_id, last_seen, change)
+    redis.call('ZREM', KEYS[2], user_id)
+    redis.call('HSET', KEYS[4], user_id, last_seen)
+    redis.call('SADD', KEYS[5], user_id)
+    redis.call('HSET', KEYS[3], user_id, change)
+end
+'''
+
+# ARGV are the sid, the current time, the expiry of the sid, the user id and
+# the change to queue. Returns 1 if the socket brought the user online
+OPEN_SOCKET_SCRIPT = PRESENCE_HELPERS + '''
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local live = redis.call('ZCARD', KEYS[1])
+local added = redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('ZADD', KEYS[2], 'GT', ARGV[3], ARGV[4])
+if added == 1 and live == 0 then
+    redis.call('HSET', KEYS[3], ARGV[4], ARGV[5])
+    return 1
+end
+return 0
+'''
+
+# ARGV are the sid, the current time, the user id, the last_seen time and the
+# change to queue. Returns 1 if the socket took the user offline
+CLOSE_SOCKET_SCRIPT = PRESENCE_HELPERS + '''
+local removed = redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+if removed == 1 and redis.call('ZCARD', KEYS[1]) == 0 then
+    go_offline(ARGV[3], ARGV[4], ARGV[5])
+    return 1
+end
+return 0
+'''
+
+# Drops the expired sockets of a user, ARGV as for CLOSE_SOCKET_SCRIPT
+# without the sid. Returns 1 if the user went offline
+PRUNE_SOCKETS_SCRIPT = PRESENCE_HELPERS + '''
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local latest = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+if #latest == 0 then
+    go_offline(ARGV[2], ARGV[3], ARGV[4])
+    return 1
+end
+redis.call('ZADD', KEYS[2], latest[2], ARGV[2])
+return 0
+'''
+
+# Deletes the last_seen times of ARGV, pairs of user ids and the times that
+# were flushed, unless a newer time was recorded since
+FORGET_LAST_SEEN_SCRIPT = '''
+local forgotten = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        forgotten = forgotten + redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return forgotten
+'''
+
+
+def socket_keys(user_id: str) -> List[str]:
+    ''' Returns the keys the socket scripts of a user operate on '''
+    return [f'presence:sockets:{user_id}', ONLINE_KEY, CHANGES_KEY,
+            LAST_SEEN_KEY, DIRTY_LAST_SEEN_KEY]
+
+
+class Presence:
+    ''' Chat presence and online status of users '''
+    def __init__(self) -> None:
+        ''' Initialize a new Presence instance '''
+        self._redis_client = get_redis_connection()
+        register = self._redis_client.register_script
+        self._clear_chat = register(CLEAR_CHAT_SCRIPT)
+        self._open_socket = register(OPEN_SOCKET_SCRIPT)
+        self._close_socket = register(CLOSE_SOCKET_SCRIPT)
+        self._prune_sockets = register(PRUNE_SOCKETS_SCRIPT)
+        self._forget_last_seen = register(FORGET_LAST_SEEN_SCRIPT)
+
+    def enter_chat(self, user_id: str, friend_id: str) -> None:
+        ''' Records that a user has the chat with a friend open, also used
+        as the heartbeat of the chat
+        '''
+        self._redis_client.set(f'in_chat:{user_id}', friend_id,
+                               ex=Config.PRESENCE_TTL)
+
+    def leave_chat(self, user_id: str, friend_id: str = None) -> None:
+        ''' Records that a user left the chat with a friend, or any chat
+        when no friend is given
+        '''
+        if friend_id is None:
+            self._redis_client.delete(f'in_chat:{user_id}')
+        else:
+            self._clear_chat(keys=[f'in_chat:{user_id}'], args=[friend_id])
+
+    def chat_of(self, user_id: str) -> Union[str, None]:
+        ''' Returns the id of the friend whose chat a user has open '''
+        return self._redis_client.get(f'in_chat:{user_id}')
+
+    def is_in_chat(self, user_id: str, friend_id: str) -> bool:
+        ''' Verifies if a user has the chat with a friend open '''
+        return self.chat_of(user_id) == friend_id
+
+    def socket_opened(self, user_id: str, sid: str) -> None:
+        ''' Registers a socket of a user, the first one brings the user
+        online
+        '''
+        now = time.time()
+        self._open_socket(keys=socket_keys(user_id),
+                          args=[sid, now, now + Config.SOCKET_TTL, user_id,
+                                json.dumps({'online': True,
+                                            'last_seen': None})])
+
+    def socket_closed(self, user_id: str, sid: str) -> None:
+        ''' Unregisters a socket of a user, the last one takes the user
+        offline
+        '''
+        last_seen = datetime.now().strftime('%Y-%m-%d %H:%M')
+        self._close_socket(keys=socket_keys(user_id),
+                           args=[sid, time.time(), user_id, last_seen,
+                                 json.dumps({'online': False,
+                                             'last_seen': last_seen})])
+
+    def renew_sockets(self, sockets: Dict[str, List[str]]) -> None:
+        ''' Renews the registration of the sockets connected to this worker,
+        sockets maps user ids to their sids. Sockets closed in the meantime
+        are not registered again
+        '''
+        expiry = time.time() + Config.SOCKET_TTL
+        pipe = self._redis_client.pipeline(transaction=False)
+        for user_id, sids in sockets.items():
+            if sids:
+                pipe.zadd(f'presence:sockets:{user_id}',
+                          {sid: expiry for sid in sids}, xx=True)
+                pipe.zadd(ONLINE_KEY, {user_id: expiry}, gt=True)
+        pipe.execute()
+
+    def prune_sockets(self, count: int) -> int:
+        ''' Drops the sockets whose registration expired, e.g. those of a
+        crashed worker, and takes their users offline when no socket is left
+        Return:
+            The number of users taken offline
+        '''
+        now = time.time()
+        user_ids = self._redis_client.zrangebyscore(ONLINE_KEY, '-inf', now,
+                                                    start=0, num=count)
+        last_seen = datetime.now().strftime('%Y-%m-%d %H:%M')
+        change = json.dumps({'online': False, 'last_seen': last_seen})
+        return sum(self._prune_sockets(keys=socket_keys(user_id),
+                                       args=[now, user_id, last_seen, change])
+                   for user_id in user_ids)
+
+    def sockets_of(self, user_id: str) -> List[str]:
+        ''' Returns the sids of the live sockets of a user on every worker
+        '''
+        return self._redis_client.zrangebyscore(
+            f'presence:sockets:{user_id}', time.time(), '+inf')
+
+    def live_sockets(self, sockets: Dict[str, str]) -> List[str]:
+        ''' Returns the sids that are still registered, sockets maps sids to
+        their user ids
+        '''
+        now = time.time()
+        pipe = self._redis_client.pipeline(transaction=False)
+        for sid, user_id in sockets.items():
+            pipe.zscore(f'presence:sockets:{user_id}', sid)
+        return [sid for sid, expiry in zip(sockets, pipe.execute())
+                if expiry is not None and expiry > now]
+
+    def online(self, user_ids: List[str]) -> Dict[str, bool]:
+        ''' Returns the online status of the given users '''
+        now = time.time()
+        pipe = self._redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zcount(f'presence:sockets:{user_id}', now, '+inf')
+        return {user_id: sockets > 0
+                for user_id, sockets in zip(user_ids, pipe.execute())}
+
+    def last_seen(self, user_ids: List[str]) -> Dict[str, Union[str, None]]:
+        ''' Returns the last time the given users went offline, None for
+        the times already flushed to MongoDB
+        '''
+        if not user_ids:
+            return {}
+        return dict(zip(user_ids,
+                        self._redis_client.hmget(LAST_SEEN_KEY, user_ids)))
+
+    def pop_changes(self) -> Dict[str, Dict]:
+        ''' Returns and empties the queued online status changes, only the
+        latest change of each user is kept until they are popped
+        '''
+        pipe = self._redis_client.pipeline()
+        pipe.hgetall(CHANGES_KEY)
+        pipe.delete(CHANGES_KEY)
+        changes, _ = pipe.execute()
+        return {user_id: json.loads(change)
+                for user_id, change in changes.items()}
+
+    def pop_dirty_last_seen(self, count: int) -> Dict[str, str]:
+        ''' Returns up to count last_seen times not flushed to MongoDB yet,
+        they are no longer marked dirty
+        '''
+        user_ids = self._redis_client.spop(DIRTY_LAST_SEEN_KEY, count)
+        if not user_ids:
+            return {}
+        return {user_id: last_seen for user_id, last_seen
+                in self.last_seen(user_ids).items() if last_seen}
+
+    def mark_last_seen_dirty(self, user_ids: List[str]) -> None:
+        ''' Marks last_seen times to be flushed again, e.g. after a failed
+        flush
+        '''
+        if user_ids:
+            self._redis_client.sadd(DIRTY_LAST_SEEN_KEY, *user_ids)
+
+    def forget_last_seen(self, last_seen: Dict[str, str]) -> int:
+        ''' Drops flushed last_seen times from Redis, the times recorded
+        again since the flush are kept
+        Return:
+            The number of times dropped
+        '''
+        if not last_seen:
+            return 0
+        return self._forget_last_seen(
+            keys=[LAST_SEEN_KEY],
+            args=[value for pair in last_seen.items() for value in pair])
+
+
+presence = Presence()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+''' User profile cache module
+Keeps the public profile of users (id, username, avatar, location) and the
+username -> id resolution in Redis so hot lookups skip MongoDB. Entries
+expire after PROFILE_CACHE_TTL seconds and are invalidated by every write to
+the user. An invalidation leaves the profile:{id}:stale tombstone for
+FILL_GUARD_SECONDS, fills are skipped while it exists so a profile read
+before a write is never cached after it. Redis errors are treated as cache
+misses.
+'''
+import json
+from typing import Dict, Union
+from redis.exceptions import RedisError
+from backend.db_ops.connections import get_redis_connection
+from config import Config
+
+PROFILE_FIELDS = ('id', 'username', 'avatar', 'location')
+# Seconds the fills of a profile are skipped after an invalidation, longer
+# than any read of the profile from MongoDB
+FILL_GUARD_SECONDS = 5
+
+# Caches a profile and its username resolution unless the profile was
+# invalidated since it was read (i.e. the stale tombstone exists)
+FILL_SCRIPT = '''
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+redis.call('SETEX', KEYS[1], ARGV[1], ARGV[2])
+redis.call('SETEX', KEYS[2], ARGV[1], ARGV[3])
+return 1
+'''
+
+
+class ProfileCache:
+    ''' Read-through cache of user profiles '''
+    def __init__(self) -> None:
+        ''' Initialize a new ProfileCache instance '''
+        self._redis_client = get_redis_connection()
+        self._fill = self._redis_client.register_script(FILL_SCRIPT)
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        ''' Kill switch of the cache, set PROFILE_CACHE_ENABLED=0 to disable
+        '''
+        return Config.PROFILE_CACHE_ENABLED
+
+    def get(self, user_id: str) -> Union[Dict, None]:
+        ''' Returns the cached profile of a user, None on a miss '''
+        if not self.enabled:
+            return None
+        try:
+            profile = self._redis_client.get(f'profile:{user_id}')
+        except RedisError:
+            self.errors += 1
+            return None
+        if profile is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(profile)
+
+    def get_user_id(self, username: str) -> Union[str, None]:
+        ''' Returns the cached id of the user with the given username, None
+        on a miss
+        '''
+        if not self.enabled:
+            return None
+        try:
+            user_id = self._redis_client.get(f'username:{username}')
+        except RedisError:
+            self.errors += 1
+            return None
+        if user_id is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return user_id
+
+    def set(self, profile: Dict) -> None:
+        ''' Caches the profile of a user and its username resolution '''
+        if not self.enabled:
+            return
+        user_id = profile['id']
+        try:
+            self._fill(keys=[f'profile:{user_id}',
+                             f'username:{profile["username"]}',
+                             f'profile:{user_id}:stale'],
+                       args=[Config.PROFILE_CACHE_TTL, json.dumps(profile),
+                             user_id])
+        except RedisError:
+            self.errors += 1
+
+    def invalidate(self, user_id: str, *usernames: str) -> None:
+        ''' Drops the cached profile of a user and the resolution of the
+        given usernames (and of the cached username), then blocks the fills
+        of the profile for FILL_GUARD_SECONDS
+        '''
+        try:
+            pipe = self._redis_client.pipeline()
+            pipe.setex(f'profile:{user_id}:stale', FILL_GUARD_SECONDS, 1)
+            pipe.get(f'profile:{user_id}')
+            profile = pipe.execute()[1]
+            if profile is not None:
+                usernames += (json.loads(profile)['username'],)
+            keys = [f'profile:{user_id}']
+            keys.extend(f'username:{name}' for name in set(usernames) if name)
+            self._redis_client.delete(*keys)
+        except RedisError:
+            self.errors += 1
+
+    def stats(self) -> Dict[str, Union[int, bool]]:
+        ''' Returns the cache counters of the current worker '''
+        return {'enabled': self.enabled, 'hits': self.hits,
+                'misses': self.misses, 'errors': self.errors}
+
+
+profile_cache = ProfileCache()
@@ -1,14 +1,241 @@
 #!/usr/bin/env python3
-''' Redis Database module '''
-import redis
-import os
-from datetime import datetime
+''' Redis Database module
+The notifications of a user are stored as JSON strings in the hash
+notifications:{user_id} keyed by id. Companion keys index the hash so no
+operation has to decode the whole of it:
+    notifications:{user_id}:next_id        counter ids are allocated from
+    notifications:{user_id}:dedupe         fingerprint -> id of the
+                                           notifications that must not be
+                                           sent twice
+    notifications:{user_id}:unread         set of the unread ids
+    notifications:{user_id}:type:requests  friend request ids by id
+    notifications:{user_id}:type:general   other notification ids by id
+    notifications:{user_id}:by_date        every id scored by its date
+    notifications:{user_id}:version        version of the indexes
+The indexes are (re)built from the hash by the scripts themselves whenever
+their version is older than INDEX_VERSION, e.g. for legacy users.
+The notifications:users set registers the hashes for the retention sweeper.
+'''
+from datetime import datetime, timedelta
 from typing import List, Union, Dict
 import json
 from backend.db_ops import db
+from backend.db_ops.connections import get_redis_connection
 
 
 DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+NOTIFICATIONS_PREFIX = 'notifications:'
+NOTIFICATION_USERS_KEY = 'notifications:users'
+# Set once the hashes created before the users registry are registered
+NOTIFICATION_USERS_BACKFILLED_KEY = 'notifications:users:backfilled'
+# Number of notifications returned per page of a notification stream
+NOTIFICATIONS_PAGE_SIZE = 20
+MAX_NOTIFICATIONS_PAGE_SIZE = 100
+
+# Lua helpers shared by the notification scripts, KEYS are the
+# notification_keys() of a user followed by the users registry. General
+# notifications may repeat, they have no fingerprint. Dates are scored as
+# their YYYYmmddHHMMSS digits.
+LUA_HELPERS = '''
+local INDEX_VERSION = 1
+
+local function fingerprint(data)
+    if data['type'] == 'general' then
+        return nil
+    end
+    return redis.sha1hex(table.concat({tostring(data['from']),
+        tostring(data['to']), tostring(data['type']),
+        tostring(data['message'])}, '\\31'))
+end
+
+local function date_score(data)
+    local digits = string.gsub(tostring(data['date'] or ''), '%D', '')
+    return tonumber(digits) or 0
+end
+
+local function index(id, data)
+    if data['read'] ~= true then
+        redis.call('SADD', KEYS[5], id)
+    end
+    if data['type'] == 'friend request' then
+        redis.call('ZADD', KEYS[6], tonumber(id), id)
+    else
+        redis.call('ZADD', KEYS[7], tonumber(id), id)
+    end
+    redis.call('ZADD', KEYS[8], date_score(data), id)
+    local key = fingerprint(data)
+    if key then
+        redis.call('HSET', KEYS[2], key, id)
+    end
+end
+
+local function bootstrap()
+    if tonumber(redis.call('GET', KEYS[4])) == INDEX_VERSION then
+        return
+    end
+    redis.call('DEL', KEYS[2], KEYS[5], KEYS[6], KEYS[7], KEYS[8])
+    local last_id = tonumber(redis.call('GET', KEYS[3])) or 0
+    local entries = redis.call('HGETALL', KEYS[1])
+    for i = 1, #entries, 2 do
+        local id = tonumber(entries[i])
+        local ok, data = pcall(cjson.decode, entries[i + 1])
+        if id and ok then
+            if id > last_id then
+                last_id = id
+            end
+            index(entries[i], data)
+        end
+    end
+    redis.call('SET', KEYS[3], last_id)
+    redis.call('SET', KEYS[4], INDEX_VERSION)
+    redis.call('SADD', KEYS[9], KEYS[1])
+end
+
+local function remove(id)
+    local notification = redis.call('HGET', KEYS[1], id)
+    if not notification then
+        return 0
+    end
+    local ok, data = pcall(cjson.decode, notification)
+    if ok then
+        local key = fingerprint(data)
+        if key and redis.call('HGET', KEYS[2], key) == id then
+            redis.call('HDEL', KEYS[2], key)
+        end
+    end
+    redis.call('SREM', KEYS[5], id)
+    redis.call('ZREM', KEYS[6], id)
+    redis.call('ZREM', KEYS[7], id)
+    redis.call('ZREM', KEYS[8], id)
+    return redis.call('HDEL', KEYS[1], id)
+end
+
+local function fetch(ids)
+    local result = {}
+    -- HMGET in chunks, unpack() is limited by the Lua stack size
+    for first = 1, #ids, 1000 do
+        local last = math.min(first + 999, #ids)
+        local notifications = redis.call('HMGET', KEYS[1],
+            unpack(ids, first, last))
+        for i = first, last do
+            if notifications[i - first + 1] then
+                table.insert(result, ids[i])
+                table.insert(result, notifications[i - first + 1])
+            end
+        end
+    end
+    return result
+end
+
+bootstrap()
+'''
+
+# ARGV[1] is the notification JSON. Returns the new id, 0 on duplicates
+NEW_NOTIFICATION_SCRIPT = LUA_HELPERS + '''
+local data = cjson.decode(ARGV[1])
+local key = fingerprint(data)
+if key and redis.call('HEXISTS', KEYS[2], key) == 1 then
+    return 0
+end
+local id = tostring(redis.call('INCR', KEYS[3]))
+redis.call('HSET', KEYS[1], id, ARGV[1])
+index(id, data)
+redis.call('SADD', KEYS[9], KEYS[1])
+return id
+'''
+
+# ARGV[1] is the id. Returns 1 when the notification exists
+MARK_AS_READ_SCRIPT = LUA_HELPERS + '''
+local notification = redis.call('HGET', KEYS[1], ARGV[1])
+if not notification then
+    return 0
+end
+local data = cjson.decode(notification)
+data['read'] = true
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(data))
+redis.call('SREM', KEYS[5], ARGV[1])
+return 1
+'''
+
+# ARGV[1] names the index to read: unread, read, requests or general.
+# The requests and general streams are paged newest first, ARGV[2] and
+# ARGV[3] bound the ids of the page and ARGV[4] limits its size. With
+# ARGV[5] set to 'asc' the page is read oldest first from ARGV[3], so a
+# page of the notifications newer than a cursor never skips any.
+# Returns the matching notifications as a flat list of id, JSON pairs
+GET_NOTIFICATIONS_SCRIPT = LUA_HELPERS + '''
+local ids
+if ARGV[1] == 'unread' then
+    ids = redis.call('SMEMBERS', KEYS[5])
+elseif ARGV[1] == 'read' then
+    ids = {}
+    for _, id in ipairs(redis.call('ZRANGE', KEYS[8], 0, -1)) do
+        if redis.call('SISMEMBER', KEYS[5], id) == 0 then
+            table.insert(ids, id)
+        end
+    end
+else
+    local stream = KEYS[7]
+    if ARGV[1] == 'requests' then
+        stream = KEYS[6]
+    end
+    if ARGV[5] == 'asc' then
+        ids = redis.call('ZRANGEBYSCORE', stream, ARGV[3], ARGV[2],
+            'LIMIT', 0, ARGV[4])
+    else
+        ids = redis.call('ZREVRANGEBYSCORE', stream, ARGV[2], ARGV[3],
+            'LIMIT', 0, ARGV[4])
+    end
+end
+return fetch(ids)
+'''
+
+# Returns the number of unread notifications
+COUNT_UNREAD_SCRIPT = LUA_HELPERS + '''
+return redis.call('SCARD', KEYS[5])
+'''
+
+# ARGV holds the ids to delete. Returns the number of deleted notifications
+DELETE_NOTIFICATIONS_SCRIPT = LUA_HELPERS + '''
+local deleted = 0
+for _, id in ipairs(ARGV) do
+    deleted = deleted + remove(id)
+end
+return deleted
+'''
+
+# ARGV[1] is the date score threshold and ARGV[2] the optional cap on the
+# number of notifications kept. Deletes the read notifications dated up to
+# the threshold, then the oldest read ones above the cap. Unread
+# notifications are always kept. Returns the number of deleted notifications
+SWEEP_NOTIFICATIONS_SCRIPT = LUA_HELPERS + '''
+local deleted = 0
+local ids = redis.call('ZRANGEBYSCORE', KEYS[8], '-inf', ARGV[1])
+for _, id in ipairs(ids) do
+    if redis.call('SISMEMBER', KEYS[5], id) == 0 then
+        deleted = deleted + remove(id)
+    end
+end
+local cap = tonumber(ARGV[2])
+if cap then
+    local excess = redis.call('HLEN', KEYS[1]) - cap
+    if excess > 0 then
+        for _, id in ipairs(redis.call('ZRANGE', KEYS[8], 0, -1)) do
+            if excess <= 0 then
+                break
+            end
+            if redis.call('SISMEMBER', KEYS[5], id) == 0 then
+                deleted = deleted + remove(id)
+                excess = excess - 1
+            end
+        end
+    end
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[9], KEYS[1])
+end
+return deleted
+'''
 
 
 def is_str_and_not_None(variables: List) -> bool:
@@ -20,21 +247,48 @@ def is_str_and_not_None(variables: List) -> bool:
     return all(var is not None and isinstance(var, str) for var in variables)
 
 
-def calc_days_diff(date_str: str) -> int:
-    ''' calculates the days difference between two datetimes '''
-    date_obj = datetime.strptime(date_str, DATETIME_FORMAT)
-    current_date = datetime.now()
-    difference = current_date - date_obj
-    return difference.days
+def notification_keys(user_id: str) -> List[str]:
+    ''' Returns the keys holding the notifications of a user followed by the
+    users registry, in the order the Lua scripts expect them
+    '''
+    notification_key = f"{NOTIFICATIONS_PREFIX}{user_id}"
+    return [notification_key] + [
+        f'{notification_key}:{suffix}' for suffix in (
+            'dedupe', 'next_id', 'version', 'unread', 'type:requests',
+            'type:general', 'by_date')] + [NOTIFICATION_USERS_KEY]
+
+
+def next_notification_cursor(page: Dict[int, Dict], limit: int,
+                             newer: bool = False) -> Union[int, None]:
+    ''' Returns the cursor to use as `before` when loading the page of
+    notifications older than the given page, or as `since` when loading the
+    page of notifications newer than it if `newer` is set
+    Return:
+        The id of the oldest (newest) notification in the page,
+        None if the page is the last one
+    '''
+    if len(page) < limit:
+        return None
+    return max(page) if newer else min(page)
+
+
+def date_score(date: datetime) -> int:
+    ''' Returns the by_date index score of a date '''
+    return int(date.strftime('%Y%m%d%H%M%S'))
 
 
 class RedisClient:
     ''' Redis client database operations '''
     def __init__(self) -> None:
         ''' Instantiatiate a new RedisClient '''
-        redis_url =  os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
-        self._redis_client = redis.StrictRedis.from_url(
-            redis_url, decode_responses=True)
+        self._redis_client = get_redis_connection()
+        register = self._redis_client.register_script
+        self._new_notification = register(NEW_NOTIFICATION_SCRIPT)
+        self._mark_as_read = register(MARK_AS_READ_SCRIPT)
+        self._get_notifications = register(GET_NOTIFICATIONS_SCRIPT)
+        self._count_unread = register(COUNT_UNREAD_SCRIPT)
+        self._delete_notifications = register(DELETE_NOTIFICATIONS_SCRIPT)
+        self._sweep = register(SWEEP_NOTIFICATIONS_SCRIPT)
 
     def new_notification(self, sender_id: str, receiver_id: str, message: str,
                          not_type: str, read=False) ->\
@@ -50,24 +304,14 @@ class RedisClient:
                                     message, not_type]):
             return None
 
-        # it is the receivers notifications not the senders
-        notification_key = f"notifications:{receiver_id}"
-        sender = db.find_user_by(id=sender_id)
-        sender_name = sender.username
-        sender_avatar = sender.avatar
-        receiver_name = db.find_user_by(id=receiver_id).username
-
-        existing_notifications = self._redis_client.hgetall(notification_key)
-        for existing_data_json in existing_notifications.values():
-            existing_data = json.loads(existing_data_json)
-            if (existing_data["from"] == sender_name and
-                    existing_data["to"] == receiver_name and
-                    existing_data["message"] == message and
-                    existing_data['type'] == not_type and
-                    existing_data['type'] != 'general'):  # exclude generals
-                return False
-
-        notification_id = str(self._redis_client.hlen(notification_key) + 1)
+        sender = db.get_profile(sender_id)
+        receiver = db.get_profile(receiver_id)
+        if sender is None or receiver is None:
+            return None
+        sender_name = sender['username']
+        sender_avatar = sender['avatar']
+        receiver_name = receiver['username']
+
         data = {
             "from": sender_name,
             "to": receiver_name,
@@ -80,9 +324,13 @@ class RedisClient:
 
         data_json = json.dumps(data)
 
-        self._redis_client.hset(notification_key, notification_id, data_json)
-
-        return self._redis_client.hget(notification_key, notification_id)
+        # it is the receivers notifications not the senders, the duplicate
+        # check and the id allocation run atomically with the write
+        notification_id = self._new_notification(
+            keys=notification_keys(receiver_id), args=[data_json])
+        if not int(notification_id):
+            return False
+        return data_json
 
     def mark_as_read(self, user_id: str, notification_id: str)\
             -> Union[bool | None]:
@@ -92,133 +340,148 @@ class RedisClient:
         '''
         if not is_str_and_not_None([user_id]):
             return None
-        not_key = f"notifications:{user_id}"
-
-        if self._redis_client.hexists(not_key, notification_id):
-            notification = self._redis_client.hget(not_key, notification_id)
-            # deserializes the notification and update the read value to true
-            not_dict = json.loads(notification)
-            not_dict['read'] = True
-
-            # serializes it back and replace the old data in the database
-            not_json = json.dumps(not_dict)
-            self._redis_client.hset(not_key, notification_id, not_json)
-            return True
-        return False
+        return self._mark_as_read(keys=notification_keys(user_id),
+                                  args=[notification_id]) == 1
+
+    def _notifications(self, user_id: str, view: str, before: int = None,
+                       since: int = None, limit: int = None)\
+            -> Dict[int, Dict]:
+        ''' Fetches the notifications of one of the indexes of a user
+        Streams are paged with ids older than `before` and newer than
+        `since`, newest first. A page with only `since` starts right after
+        it, oldest first, so following its cursor reaches the newest
+        notification without a gap
+        Return:
+            Notifications (dict) in the format {id1: data1, ...}
+        '''
+        max_id = f'({before}' if isinstance(before, int) else '+inf'
+        min_id = f'({since}' if isinstance(since, int) else '-inf'
+        if not isinstance(limit, int) or limit < 1:
+            limit = NOTIFICATIONS_PAGE_SIZE
+        limit = min(limit, MAX_NOTIFICATIONS_PAGE_SIZE)
+        order = 'asc' if isinstance(since, int)\
+            and not isinstance(before, int) else 'desc'
+        result = self._get_notifications(keys=notification_keys(user_id),
+                                         args=[view, max_id, min_id, limit,
+                                               order])
+        # deserializes the id/data pairs
+        return {int(result[i]): json.loads(result[i + 1])
+                for i in range(0, len(result), 2)}
 
     def get_read_notifications(self, user_id: str) ->\
             Union[Dict[str, any] | None]:
         ''' Returns all read notifications of a given user '''
         if not is_str_and_not_None([user_id]):
             return None
-        not_key = f"notifications:{user_id}"
-        seriaized_notifications = self._redis_client.hgetall(not_key)
-
-        # deserializes all key/value pairs
-        all_notifications = {
-            json.loads(not_id): json.loads(not_data)
-            for not_id, not_data in seriaized_notifications.items()
-            }
-
-        # filtering read location
-        read_notifications = {not_id: not_data for not_id, not_data in
-                              all_notifications.items()
-                              if not_data.get('read') is True}
-
-        return read_notifications
+        return self._notifications(user_id, 'read')
 
     def get_unread_notifications(self, user_id: str) ->\
             Union[Dict[str, any] | None]:
         ''' Returns all unread notifications of a given user '''
         if not is_str_and_not_None([user_id]):
             return None
-        not_key = f"notifications:{user_id}"
-        seriaized_notifications = self._redis_client.hgetall(not_key)
-
-        # deserializes all key/value pairs
-        all_notifications = {
-            json.loads(not_id): json.loads(not_data)
-            for not_id, not_data in seriaized_notifications.items()
-            }
-
-        # filtering read location
-        unread_notifications = {
-            not_id: not_data for not_id, not_data in
-            all_notifications.items() if not_data.get('read') is False
-            }
+        return self._notifications(user_id, 'unread')
 
-        return unread_notifications
+    def count_unread_notifications(self, user_id: str) -> int:
+        ''' Returns the number of unread notifications of a given user '''
+        if not is_str_and_not_None([user_id]):
+            return 0
+        return self._count_unread(keys=notification_keys(user_id))
 
-    def get_friend_requests(self, user_id: str) ->\
+    def get_friend_requests(self, user_id: str, before: int = None,
+                            since: int = None,
+                            limit: int = NOTIFICATIONS_PAGE_SIZE) ->\
             Union[Dict[str, any] | None]:
-        ''' Gets all friend request of a given user_id
+        ''' Gets a page of the friend requests of a given user_id, newest
+        first
+        before and since are notification ids the page must be older and
+        newer than respectively, a page with only since is read oldest first
         Return:
             Friend requests (dict) on success, None otherwise
         '''
-        not_key = f"notifications:{user_id}"
-        seriaized_notifications = self._redis_client.hgetall(not_key)
-
-        # deserializes all key/value pairs
-        all_notifications = {
-            json.loads(not_id): json.loads(not_data)
-            for not_id, not_data in seriaized_notifications.items()
-            }
-
-        # Filter friend requests
-        friend_requests = {
-            not_id: not_data for not_id, not_data
-            in all_notifications.items()
-            if not_data.get('type') == 'friend request'
-            }
-        return friend_requests
-
-    def get_general_notifications(self, user_id: str) ->\
+        if not is_str_and_not_None([user_id]):
+            return None
+        return self._notifications(user_id, 'requests', before, since, limit)
+
+    def get_general_notifications(self, user_id: str, before: int = None,
+                                  since: int = None,
+                                  limit: int = NOTIFICATIONS_PAGE_SIZE) ->\
             Union[Dict[str, any] | None]:
-        ''' Gets all notifications of a given user_id that are not friend
-            requests
+        ''' Gets a page of the notifications of a given user_id that are not
+            friend requests, newest first
+        before and since are notification ids the page must be older and
+        newer than respectively, a page with only since is read oldest first
         Return:
             general notifications (dict) on success format {id1: data1, ...}
             None otherwise
         '''
-        not_key = f"notifications:{user_id}"
-        seriaized_notifications = self._redis_client.hgetall(not_key)
-
-        # deserializes all key/value pairs
-        all_notifications = {
-            json.loads(not_id): json.loads(not_data)
-            for not_id, not_data in seriaized_notifications.items()
-            }
-
-        general_nots = {
-            not_id: not_data for not_id, not_data in
-            all_notifications.items() if
-            not_data.get('type') != 'friend request'
-            }
-        return general_nots
+        if not is_str_and_not_None([user_id]):
+            return None
+        return self._notifications(user_id, 'general', before, since, limit)
 
     def delete_read_notifications_older_than(self, user_id: str,
                                              days_threshold: int = 30)\
             -> Union[bool | None]:
-        ''' Remove all read notifications that are not friend requests '''
+        ''' Remove all read notifications older than days_threshold days '''
         if not is_str_and_not_None([user_id]):
             return None
 
-        read_notifications = self.get_read_notifications(user_id)
-        if not read_notifications:
-            return None
-        notification_key = f"notifications:{user_id}"
-
-        # Gets a list of all read notification ids > days_threshold
-        ids_gt_threshold = [
-            not_id for not_id, not_data in read_notifications.items()
-            if 'date' in not_data and calc_days_diff(not_data['date'])
-            > days_threshold
-        ]
-        if ids_gt_threshold:
-            self._redis_client.hdel(notification_key, *ids_gt_threshold)
+        # notifications more than days_threshold whole days old
+        threshold = datetime.now() - timedelta(days=days_threshold + 1)
+        deleted = self._sweep(keys=notification_keys(user_id),
+                              args=[date_score(threshold)])
+        if deleted:
             return True
         return None
 
+    def sweep_notifications(self, days_threshold: int, max_per_user: int,
+                            batch_size: int = 100) -> int:
+        ''' Applies the retention policy to the notifications of every user
+        Read notifications older than days_threshold days are deleted, then
+        the oldest read ones of users holding more than max_per_user
+        notifications. Users are swept batch_size at a time, one pipeline
+        per batch
+        Return:
+            The number of deleted notifications
+        '''
+        if not self._redis_client.exists(NOTIFICATION_USERS_BACKFILLED_KEY):
+            self._register_notification_users()
+
+        threshold = datetime.now() - timedelta(days=days_threshold + 1)
+        args = [date_score(threshold), max_per_user]
+        deleted = 0
+        batch = []
+        for key in self._redis_client.sscan_iter(NOTIFICATION_USERS_KEY,
+                                                 count=batch_size):
+            batch.append(key[len(NOTIFICATIONS_PREFIX):])
+            if len(batch) == batch_size:
+                deleted += self._sweep_batch(batch, args)
+                batch = []
+        if batch:
+            deleted += self._sweep_batch(batch, args)
+        return deleted
+
+    def _sweep_batch(self, user_ids: List[str], args: List) -> int:
+        ''' Sweeps the notifications of a batch of users in one round trip '''
+        pipe = self._redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            self._sweep(keys=notification_keys(user_id), args=args,
+                        client=pipe)
+        return sum(pipe.execute())
+
+    def _register_notification_users(self) -> None:
+        ''' Registers the notification hashes created before the users
+        registry existed, once. The registry itself is created by the first
+        notification or connection, so its existence does not tell whether
+        the legacy hashes were registered
+        '''
+        keys = [key for key in self._redis_client.scan_iter(
+                    match=f'{NOTIFICATIONS_PREFIX}*', count=1000)
+                if key.count(':') == 1 and key != NOTIFICATION_USERS_KEY]
+        for i in range(0, len(keys), 1000):
+            self._redis_client.sadd(NOTIFICATION_USERS_KEY, *keys[i:i + 1000])
+        self._redis_client.set(NOTIFICATION_USERS_BACKFILLED_KEY, 1)
+
     def delete_notification(self, user_id: str, notification_id: str)\
             -> Union[bool | None]:
         ''' Deletes a user notification with a given id
@@ -228,19 +491,22 @@ class RedisClient:
         if not is_str_and_not_None([user_id, notification_id]):
             return None
 
-        notification_key = f"notifications:{user_id}"
-
-        num_del = self._redis_client.hdel(notification_key, notification_id)
+        num_del = self._delete_notifications(keys=notification_keys(user_id),
+                                             args=[notification_id])
         if num_del > 0:
             return True
         return False
 
     def delete_all_notifications(self, user_id: str) -> bool:
-        ''' Deletes all notifications for a given user '''
+        ''' Deletes all notifications for a given user
+        The id counter is kept, ids are never reused so the cursors held by
+        clients stay valid
+        '''
         if not is_str_and_not_None([user_id]):
             return False
 
-        notification_key = f"notifications:{user_id}"
-        print('entered to delere')
-
-        return self._redis_client.delete(notification_key) > 0
+        keys = notification_keys(user_id)
+        self._redis_client.srem(NOTIFICATION_USERS_KEY, keys[0])
+        # the users registry is the last key, it is shared
+        return self._redis_client.delete(
+            *[key for key in keys[:-1] if not key.endswith(':next_id')]) > 0
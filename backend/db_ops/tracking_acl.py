@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+''' Tracking access control module
+Keeps the friends allowed to track each user in Redis, in the set
+trackers:{user_id}, so the location read and push paths check permissions
+with a single set membership lookup instead of loading user documents.
+The sets are written through by the track access grants and revocations.
+On a cold Redis, marked by the absence of trackers:loaded, a background
+task rebuilds them from the tracking_me maps stored in MongoDB, permissions
+are read from MongoDB until the rebuild completes.
+Revocations are written to Redis before MongoDB and recorded in the
+trackers:revoked sorted set for REVOKED_TTL seconds. The rebuild removes
+them again once it is done, so a permission revoked while the rebuild read
+an older copy of it is never restored. A new grant clears the record.
+'''
+import time
+from typing import List
+from backend.db_ops import db
+from backend.db_ops.connections import get_redis_connection
+
+LOADED_KEY = 'trackers:loaded'
+REBUILD_LOCK_KEY = 'trackers:rebuild:lock'
+# Seconds a worker may take to rebuild the sets before another one retries
+REBUILD_LOCK_TTL = 300
+REBUILD_BATCH_SIZE = 500
+REVOKED_KEY = 'trackers:revoked'
+# Seconds a revocation is recorded, longer than any rebuild
+REVOKED_TTL = 2 * REBUILD_LOCK_TTL
+
+
+class TrackingACL:
+    ''' Friends allowed to track each user '''
+    def __init__(self) -> None:
+        ''' Initialize a new TrackingACL instance '''
+        self._redis_client = get_redis_connection()
+
+    def allow(self, user_id: str, tracker_id: str) -> None:
+        ''' Allows a friend to track a user '''
+        pipe = self._redis_client.pipeline()
+        pipe.sadd(f'trackers:{user_id}', tracker_id)
+        pipe.zrem(REVOKED_KEY, f'{user_id}:{tracker_id}')
+        pipe.execute()
+
+    def revoke(self, user_id: str, tracker_id: str) -> None:
+        ''' Revokes the permission of a friend to track a user, it must be
+        called before the revocation is written to MongoDB
+        '''
+        now = time.time()
+        pipe = self._redis_client.pipeline()
+        pipe.srem(f'trackers:{user_id}', tracker_id)
+        pipe.zadd(REVOKED_KEY, {f'{user_id}:{tracker_id}': now})
+        pipe.zremrangebyscore(REVOKED_KEY, '-inf', now - REVOKED_TTL)
+        pipe.execute()
+
+    def delete(self, user_id: str) -> None:
+        ''' Drops the trackers of a user, e.g. when the user is removed '''
+        self._redis_client.delete(f'trackers:{user_id}')
+
+    def is_tracker(self, user_id: str, tracker_id: str) -> bool:
+        ''' Verifies if a friend is allowed to track a user '''
+        pipe = self._redis_client.pipeline(transaction=False)
+        pipe.sismember(f'trackers:{user_id}', tracker_id)
+        pipe.exists(LOADED_KEY)
+        pipe.zscore(REVOKED_KEY, f'{user_id}:{tracker_id}')
+        allowed, loaded, revoked = pipe.execute()
+        if loaded:
+            return bool(allowed)
+        return revoked is None\
+            and tracker_id in self._stored_trackers(user_id)
+
+    def filter_trackers(self, user_id: str, candidates: List[str])\
+            -> List[str]:
+        ''' Returns the candidates allowed to track a user '''
+        if not candidates:
+            return []
+        pipe = self._redis_client.pipeline(transaction=False)
+        pipe.smismember(f'trackers:{user_id}', candidates)
+        pipe.exists(LOADED_KEY)
+        pipe.zmscore(REVOKED_KEY, [f'{user_id}:{candidate}'
+                                   for candidate in candidates])
+        allowed, loaded, revoked = pipe.execute()
+        if loaded:
+            return [candidate for candidate, is_allowed
+                    in zip(candidates, allowed) if is_allowed]
+        trackers = self._stored_trackers(user_id)
+        return [candidate for candidate, revoked_at
+                in zip(candidates, revoked)
+                if candidate in trackers and revoked_at is None]
+
+    def _stored_trackers(self, user_id: str) -> List[str]:
+        ''' Reads the trackers of a user from MongoDB while the sets are not
+        loaded
+        '''
+        user = db.find_user_by(id=user_id)
+        return list(user.tracking_me) if user else []
+
+    def rebuild(self) -> bool:
+        ''' Rebuilds the tracker sets of every user from MongoDB, unless
+        they are loaded or another worker is rebuilding them
+        Return:
+            True if this call rebuilt the sets, False otherwise
+        '''
+        if self._redis_client.exists(LOADED_KEY):
+            return False
+        if not self._redis_client.set(REBUILD_LOCK_KEY, 1, nx=True,
+                                      ex=REBUILD_LOCK_TTL):
+            return False
+        try:
+            # grants written through since Redis went cold are kept
+            pipe = self._redis_client.pipeline()
+            for user_id, trackers in db.iter_tracking_me(REBUILD_BATCH_SIZE):
+                pipe.sadd(f'trackers:{user_id}', *trackers)
+                if len(pipe) >= REBUILD_BATCH_SIZE:
+                    pipe.execute()
+            pipe.execute()
+
+            # the revocations read as grants by the rebuild are removed
+            # again, the ones recorded from now on already are
+            revoked = self._redis_client.zrangebyscore(
+                REVOKED_KEY, time.time() - REVOKED_TTL, '+inf')
+            pipe = self._redis_client.pipeline()
+            for member in revoked:
+                user_id, tracker_id = member.split(':', 1)
+                pipe.srem(f'trackers:{user_id}', tracker_id)
+            pipe.set(LOADED_KEY, 1)
+            pipe.execute()
+        finally:
+            self._redis_client.delete(REBUILD_LOCK_KEY)
+        return True
+
+
+tracking_acl = TrackingACL()
@@ -1,31 +1,40 @@
 #!/usr/bin/env python3
 ''' User preference/choices '''
-from typing import Union, List
-from backend.db_ops.database import DB
+import time
+from datetime import timezone
+from typing import Dict, Iterator, Union, List
+from backend.db_ops import db
+from backend.db_ops.location_store import is_valid_coordinates,\
+    location_store
+from backend.db_ops.presence import presence
+from backend.db_ops.tracking_acl import tracking_acl
 from backend.auth import AUTH
+from backend.models.helpers import location_coordinates
+from backend.utils import utils
 
 
 class Choice:
     ''' Sets various permissions to the database based on user choices '''
     def __init__(self) -> None:
-        self._db = DB()
+        self._db = db
 
     def set_location(self, user_id: str,
-                     location: List[Union[int, float]]) -> bool:
-        ''' Sets a user location '''
-        user = self._db.find_user_by(id=user_id)
-        if not user:
-            return False
-        self._db.update_user(user_id, location=location)
-        return True
+                     location: List[Union[int, float]]) -> Union[bool, None]:
+        ''' Sets a user location in the hot location store, it reaches the
+        database with the next flush
+        Return:
+            True if the location was stored,
+            False if the user did not move enough for it to be stored,
+            None if the location is invalid
+        '''
+        if not is_valid_coordinates(location):
+            return None
+        return location_store.update(user_id, location)
 
     def remove_location(self, user_id: str) -> bool:
         ''' Removes a user location '''
-        user = self._db.find_user_by(id=user_id)
-        if not user:
-            return False
-        self._db.update_user(user.id, location=None)
-        return True
+        removed_at = location_store.remove(user_id)
+        return self._db.remove_location(user_id, removed_at) is not None
 
     def add_friend(self, user_id: str, friend_id: str) -> bool:
         ''' Adds a new friend to a user and friend friends dictionary
@@ -34,27 +43,23 @@ class Choice:
         '''
         try:
             user, friend = AUTH.is_valid_user_and_friend(user_id, friend_id)
-            # Get and update friends dictionary of the user
-            user_friend_dict = user.friends
+            # Add friend to the friends dictionary of the user
             new_friend = {
                 'id': friend_id,
                 'username': friend.username,
                 'last_seen': None,
                 'avatar': friend.avatar
                 }
-            user_friend_dict[friend_id] = new_friend
-            self._db.update_user(user_id, friends=user_friend_dict)
+            self._db.update_user_map(user_id, 'friends', friend_id, new_friend)
 
             # add user to friend's friend_dict too
-            friend_friends_dict = friend.friends
             user_data = {
                 'id': user_id,
                 'username': user.username,
                 'last_seen': None,
                 'avatar': user.avatar
                 }
-            friend_friends_dict[user_id] = user_data
-            self._db.update_user(friend_id, friends=friend_friends_dict)
+            self._db.update_user_map(friend_id, 'friends', user_id, user_data)
             return True
         except ValueError:
             return False
@@ -82,18 +87,15 @@ class Choice:
                     for id, friend_info in user_friends.items():
                         if friend_info.get('username') == friend:
                             friend_id = id
-                            del user_friends[friend_id]
-                            self._db.update_user(user_id, friends=user_friends)
+                            self._db.update_user_map(
+                                user_id, 'friends', friend_id)
                             # return since 2 users cant have 1 username
                             return friend_id
                     return False
-            friend_id = friend_obj
-            friend_dict = user.friends
-            if friend_id in friend_dict:
-                del friend_dict[friend_id]
-            else:
+            friend_id = friend_obj.id
+            if friend_id not in user.friends:
                 return False
-            self._db.update_user(user_id, friends=friend_dict)
+            self._db.update_user_map(user_id, 'friends', friend_id)
             return friend_id
         except ValueError:
             return False
@@ -111,10 +113,10 @@ class Choice:
 
         try:
             user, friend = AUTH.is_valid_user_and_friend(user_id, friend_id)
-            friend_allowed_tracks = friend.allowed_tracks
 
             # check if user is already in the dictionary
-            if user_id in friend_allowed_tracks:
+            if user_id in friend.allowed_tracks:
+                tracking_acl.allow(user_id, friend_id)
                 return True
 
             user_data = {
@@ -122,19 +124,18 @@ class Choice:
                 "location": user.location,
                 "avatar": user.avatar,
             }
-            friend_allowed_tracks[user_id] = user_data
-
-            self._db.update_user(friend_id, allowed_tracks=friend_allowed_tracks)
+            self._db.update_user_map(
+                friend_id, 'allowed_tracks', user_id, user_data)
 
+            # the trail of the user before the grant stays hidden
             friend_data = {
                 "username": friend.username,
-                "avatar": friend.avatar
+                "avatar": friend.avatar,
+                "granted_at": int(time.time())
             }
-
-            users_tracking_me = user.tracking_me
-            users_tracking_me[friend_id] = friend_data
-
-            self._db.update_user(user_id, tracking_me=users_tracking_me)
+            self._db.update_user_map(
+                user_id, 'tracking_me', friend_id, friend_data)
+            tracking_acl.allow(user_id, friend_id)
 
             return True
         except ValueError:
@@ -152,46 +153,40 @@ class Choice:
 
         try:
             user, friend = AUTH.is_valid_user_and_friend(user_id, friend_id)
-            friend_allowed_tracks = friend.allowed_tracks
 
-            if user.id not in friend_allowed_tracks:
+            if user.id not in friend.allowed_tracks:
                 return False
-            del friend_allowed_tracks[user_id]
-            self._db.update_user(friend_id, allowed_tracks=friend_allowed_tracks)
+            # the permission is revoked in Redis first, a failure leaves it
+            # granted in both stores
+            tracking_acl.revoke(user_id, friend_id)
+            self._db.update_user_map(friend_id, 'allowed_tracks', user_id)
 
             # remove friend from user's tracking me dictionary
-            users_tracking_me = user.tracking_me
-            del users_tracking_me[friend_id]
-
-            self._db.update_user(user_id, tracking_me=users_tracking_me)
+            self._db.update_user_map(user_id, 'tracking_me', friend_id)
 
             return True
         except ValueError:
             return False
 
     def create_conversation(self, user_id: str, friend_id: str) -> str:
-        ''' Creates a new conversation
+        ''' Creates a new conversation if none exists between user and friend
         Return:
             The conversation id on success
             None otherwise
         '''
-        return self._db.new_conversation(user_id, friend_id).id
+        conversation = self._db.get_or_create_conversation(user_id, friend_id)
+        if conversation is None:
+            return None
+        return conversation.id
 
     def friend_currently_in_chat(self, user_id: str, friend_id: str) -> bool:
         ''' Verifies if a friend is currently in the chatbox of chat with
-        user in the Conversation object in the database
+        user, from the presence service
         Return:
             True if user is in the chat space
             False otherwise
         '''
-        friend_name = self._db.find_user_by(id=friend_id).username
-        participants = [user_id, friend_id]
-        conversation = self._db.find_conversation_by(participants=participants)
-        is_in_chat = conversation.is_in_chat
-        status = is_in_chat.get(friend_name, False)
-        if status is True:
-            return True
-        return False
+        return presence.is_in_chat(friend_id, user_id)
 
     def get_friend_location(self, user_id: str, friend_name: str)\
             -> Union[List[float], bool, None]:
@@ -204,15 +199,99 @@ class Choice:
             False if friend's coordinates is empty (i.e. friend might have
             disallowed his location)
         '''
+        friend_id = self._db.get_user_id(friend_name)
+        # a single set membership lookup, no user document is loaded
+        if friend_id and tracking_acl.is_tracker(friend_id, user_id):
+            # the hot store holds the latest location
+            friend_location = location_store.get(friend_id)
+            if friend_location:
+                return friend_location
+            friend = self._db.get_profile(friend_id)
+            if friend is None:
+                return None
+            friend_location = location_coordinates(friend['location'])
+
+            if friend_location:
+                return friend_location
+            return False
+        return None
+
+    def get_friend_trail(self, user_id: str, friend_name: str, since: int,
+                         until: int) -> Union[Iterator[Dict], None]:
+        ''' Returns the path of a friend in the user's allowed_tracks over
+        the [since, until] window, given in seconds since the epoch
+        The window starts no earlier than the time the friend granted the
+        track access
+        Return:
+            An iterator of chunks, one per hour of history, in the format
+            {'start': seconds since the epoch, 'offsets': [seconds since
+            start, ...], 'polyline': encoded [lat, long] points} on success,
+            None if friend is not in user's allowed track or does not exist
+        '''
+        friend_id = self._db.get_user_id(friend_name)
+        if not friend_id or not tracking_acl.is_tracker(friend_id, user_id):
+            return None
+        friend = self._db.find_user_by(id=friend_id)
+        grant = (friend.tracking_me if friend else {}).get(user_id)
+        if grant is None:
+            return None
+        since = max(since, grant.get('granted_at') or since)
+
+        def chunks():
+            for bucket in self._db.get_location_history(friend_id, since,
+                                                        until):
+                start = int(bucket['bucket'].replace(
+                    tzinfo=timezone.utc).timestamp())
+                points = [point for point in sorted(bucket['points'])
+                          if since <= start + point[0] <= until]
+                if not points:
+                    continue
+                first = start + points[0][0]
+                yield {'start': first,
+                       'offsets': [start + point[0] - first
+                                   for point in points],
+                       'polyline': utils.encode_polyline(
+                           [point[1:] for point in points])}
+        return chunks()
+
+    def get_friends_locations(self, user_id: str)\
+            -> Union[Dict[str, Union[List[float], None]], None]:
+        ''' Returns the locations of every friend in the user's
+        allowed_tracks, the latest ones of the hot store override the ones
+        flushed to the database
+        Return:
+            A dict of friend usernames to their location (None when the
+            friend has no location) on success, None if user does not exist
+        '''
+        user = self._db.find_user_by(id=user_id)
+        if user is None:
+            return None
+        friend_ids = list(user.allowed_tracks)
+        friends = self._db.get_locations(friend_ids)
+        latest = location_store.get_many(list(friends))
+        return {friend['username']: latest.get(friend_id) or
+                friend['location']
+                for friend_id, friend in friends.items()}
+
+    def get_nearby_friends(self, user_id: str, radius: float,
+                           origin: List[float] = None)\
+            -> Union[List[Dict], bool, None]:
+        ''' Returns the friends in the user's allowed_tracks located within
+        radius meters of origin, nearest first. origin defaults to the
+        user's own location. Distances use the locations flushed to the
+        database, at most LOCATION_FLUSH_INTERVAL seconds old
+        Return:
+            The list of nearby friends on success,
+            False if no origin is given and the user has no location,
+            None if user does not exist
+        '''
         user = self._db.find_user_by(id=user_id)
-        friend = self._db.find_user_by(username=friend_name)
-        friend_id = friend.id
-        if friend_id:
-            user_allowed_tracks = user.allowed_tracks
-            if friend_id in user_allowed_tracks:
-                friend_location = friend.location.get('coordinates')
-
-                if friend_location:
-                    return friend_location
+        if user is None:
+            return None
+        if origin is None:
+            origin = location_store.get(user_id) or \
+                location_coordinates(user.location)
+            if origin is None:
                 return False
-        return None
+        return self._db.get_nearby_users(list(user.allowed_tracks), origin,
+                                         radius)
@@ -2,13 +2,35 @@
 ''' Conversations Model '''
 from backend.models.base_model import BaseModel
 from backend.models.messages import Message
+from backend.models.helpers import make_participant_key
 
 
 class Conversation(BaseModel):
     ''' Defines the Conversations class '''
+    # attributes stored in the conversations collection
+    FIELDS = ('id', 'created_at', 'updated_at', 'participants',
+              'participant_key', 'message_count', 'read_cursors',
+              'last_received', 'unread_counts', 'last_message',
+              'last_message_at', 'version')
+
     def __init__(self, **kwargs):
         ''' Instantiates a new Conversations instance '''
         super().__init__(**kwargs)
         self.participants = kwargs.get('participants')
-        self.messages = kwargs.get('messages', {})
-        self.is_in_chat = kwargs.get('is_in_chat', {})
+        self.participant_key = kwargs.get('participant_key')
+        if self.participant_key is None and self.participants:
+            self.participant_key = make_participant_key(self.participants)
+        # messages are stored in message buckets, this is the sequence
+        # number of the latest message in the conversation
+        self.message_count = kwargs.get('message_count', 0)
+        # per participant id, sequence number of the last message read and
+        # of the last message received
+        self.read_cursors = kwargs.get('read_cursors', {})
+        self.last_received = kwargs.get('last_received', {})
+        # inbox summary: unread messages per participant id and a preview
+        # of the latest message
+        self.unread_counts = kwargs.get('unread_counts', {})
+        self.last_message = kwargs.get('last_message', None)
+        self.last_message_at = kwargs.get('last_message_at', None)
+        # incremented by every update, used for optimistic concurrency
+        self.version = kwargs.get('version', 0)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 ''' Models' helper functions '''
+from typing import List, Union
 
 
 def is_sha256_hashed_password(password: str) -> bool:
@@ -11,6 +12,63 @@ def is_sha256_hashed_password(password: str) -> bool:
     return bool(re.match(sha256_pattern, password))
 
 
+def hash_password(password: str) -> str:
+    ''' Returns the SHA256 hash of a password, already hashed passwords are
+    returned as they are
+    '''
+    import hashlib
+    if password is None or type(password) is not str:
+        raise ValueError('Password cannot be None and must be a string')
+
+    # Useful during object reinstantiation from json format
+    if is_sha256_hashed_password(password):
+        return password
+    return hashlib.sha256(password.encode()).hexdigest().lower()
+
+
+# the stored locations are GeoJSON points ordered [long, lat], the users
+# whose location is written in that order are marked with this format
+LOCATION_FORMAT = 2
+
+
+def make_location(coordinates) -> Union[dict, None]:
+    ''' Builds the GeoJSON point of a [lat, long] pair, GeoJSON orders the
+    coordinates [long, lat]. Already built locations are returned as they are
+    Return:
+        The location dict, None when the coordinates are invalid
+    '''
+    if is_valid_location(coordinates):
+        return coordinates
+    if not isinstance(coordinates, (list, tuple)) or len(coordinates) != 2:
+        return None
+    if not all(isinstance(x, (int, float)) for x in coordinates):
+        return None
+    lat, long = coordinates
+    if not (-90 <= lat <= 90 and -180 <= long <= 180):
+        return None
+    return {
+        "type": "Point",
+        "coordinates": [long, lat]
+    }
+
+
+def location_coordinates(location) -> Union[List[float], None]:
+    ''' Returns the [lat, long] pair of a GeoJSON point, the order the API
+    and the clients use
+    '''
+    if not is_valid_location(location):
+        return None
+    long, lat = location['coordinates']
+    return [lat, long]
+
+
+def make_participant_key(participants: list) -> str:
+    ''' Builds the canonical key of a conversation's participants, it is the
+    same whatever the order of the participants ids
+    '''
+    return ':'.join(sorted(participants))
+
+
 def is_valid_location(location: dict) -> bool:
     ''' Verifies if a location is an already defined location according to
     the already defined location format, i.e. {
@@ -22,9 +80,11 @@ def is_valid_location(location: dict) -> bool:
         return False
     if 'type' not in location or 'coordinates' not in location:
         return False
-    if location.get('type') != 'Point' and not isinstance(
+    if location.get('type') != 'Point' or not isinstance(
             location.get('coordinates'), list):
         return False
+    if len(location.get('coordinates')) != 2:
+        return False
     if not all(isinstance(x, (int, float)) for x in location.get(
                                             'coordinates')):
         return False
@@ -11,8 +11,5 @@ class Message(BaseModel):
         self.receiver = kwargs.get('receiver', None)
         self.content = kwargs.get('content', None)
         self.content_type = kwargs.get('content_type', 'Text')
-        self.read = kwargs.get('read', False)
-
-    def mark_as_read(self) -> None:
-        ''' Sets read attribute to True '''
-        self.read = True
+        # position of the message in its conversation, starting from 1
+        self.seq = kwargs.get('seq', None)
@@ -4,11 +4,19 @@ from typing import List, Union
 import hashlib
 from flask_login import UserMixin
 from backend.models.base_model import BaseModel
-from backend.models.helpers import is_sha256_hashed_password, is_valid_location
+from backend.models.helpers import hash_password, make_location
 
 
 class User(BaseModel, UserMixin):
     ''' Defines the User class '''
+    # attributes stored in the users collection
+    FIELDS = ('id', 'created_at', 'updated_at', 'full_name', 'email',
+              'username', '_password', 'reset_token', 'avatar', 'friends',
+              'allowed_tracks', 'tracking_me', 'location', 'session_id',
+              'version')
+    # embedded maps keyed by friend id
+    MAP_FIELDS = ('friends', 'allowed_tracks', 'tracking_me')
+
     def __init__(self, **kwargs):
         ''' Instantiates a new User object '''
         super().__init__(**kwargs)
@@ -25,20 +33,13 @@ class User(BaseModel, UserMixin):
         self.tracking_me = kwargs.get('tracking_me', {})
         self.location = self.set_location(kwargs.get('location'))
         self.session_id = kwargs.get('session_id', None)
+        # incremented by every update, used for optimistic concurrency
+        self.version = kwargs.get('version', 0)
 
     def set_password(self, pwd: str):
         """ Setter of a new password: encrypt in SHA256
         """
-        if pwd is None or type(pwd) is not str:
-            raise ValueError('Password cannot be None and must be a string')
-
-        # Checks if password is already a hashed password
-        # Useful during object reinstantiation from json format
-        if is_sha256_hashed_password(pwd):
-            password = pwd
-        else:
-            password = hashlib.sha256(pwd.encode()).hexdigest().lower()
-        return password
+        return hash_password(pwd)
 
     def is_valid_password(self, pwd: str) -> bool:
         ''' Validates the hashed password '''
@@ -57,18 +58,7 @@ class User(BaseModel, UserMixin):
             raise ValueError('Password cannot be None and must be a string')
         self._password = self.set_password(new_pwd)
 
-    def set_location(self, coordinates: List[Union[int, float]]) -> dict:
-        ''' Sets a user location '''
-        if is_valid_location(coordinates):
-            location = coordinates
-        elif coordinates is None or len(coordinates) != 2:
-            location = {}
-        elif not all(isinstance(x, (int, float)) for x in coordinates):
-            location = {}
-        else:
-            lat, long = coordinates
-            location = {
-                "type": "Point",
-                "coordinates": [lat, long]
-            }
-        return location
+    def set_location(self, coordinates: List[Union[int, float]])\
+            -> Union[dict, None]:
+        ''' Sets a user location, coordinates is a [lat, long] pair '''
+        return make_location(coordinates)
@@ -3,6 +3,7 @@
 from PIL import Image
 import os
 import shutil
+from typing import List
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -23,6 +24,23 @@ class Utils:
         img = Image.open(input_path)
         img.save(output_path, quality=quality)
 
+    def encode_polyline(self, points: List[List[int]]) -> str:
+        ''' Encodes [lat, long] pairs already scaled by 1e5 to integers with
+        the encoded polyline algorithm format (precision 5)
+        '''
+        encoded = []
+        previous = [0, 0]
+        for point in points:
+            for i in (0, 1):
+                value = point[i] - previous[i]
+                previous[i] = point[i]
+                value = ~(value << 1) if value < 0 else value << 1
+                while value >= 0x20:
+                    encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                    value >>= 5
+                encoded.append(chr(value + 63))
+        return ''.join(encoded)
+
     def copy_and_rename_file(self, original_path, new_name):
         try:
             # Copy the file to the new name
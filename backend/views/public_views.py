@@ -3,15 +3,18 @@
 from flask import render_template, redirect, url_for, request, flash, jsonify,\
     session
 from urllib.parse import urlsplit
+import hmac
 import re
 from backend.models.forms import LoginForm, SignUpForm
 from flask_login import current_user, login_user
 from backend.views import pub_views
 from backend.auth import AUTH
-from backend.db_ops.database import DB
+from backend.db_ops import identity_map
+from backend.db_ops.connections import mongo_connection_stats
+from backend.db_ops.location_store import location_store
+from backend.db_ops.profile_cache import profile_cache
 from backend.models.forms import LoginForm, SignUpForm
-
-db = DB()
+from config import Config
 
 
 @pub_views.route('/')
@@ -26,6 +29,25 @@ def about():
     return render_template('about.html')
 
 
+@pub_views.route('/status/connections')
+def connection_stats():
+    ''' Returns the database connection pool statistics of the worker that
+    served the request, with the number of lookups served by request
+    identity maps (i.e. database round trips saved) and the flush lag of
+    the hot location store
+    Internal endpoint, it is only served to requests carrying the
+    STATUS_TOKEN in the X-Status-Token header
+    '''
+    token = request.headers.get('X-Status-Token', '')
+    if not Config.STATUS_TOKEN or not hmac.compare_digest(
+            token.encode(), Config.STATUS_TOKEN.encode()):
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({'mongo': mongo_connection_stats(),
+                    'identity_map': identity_map.stats,
+                    'profile_cache': profile_cache.stats(),
+                    'locations': location_store.stats()})
+
+
 @pub_views.route('/signup', methods=['GET', 'POST'])
 def signup():
     ''' Handles the creation of new User object '''
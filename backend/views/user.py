@@ -7,12 +7,11 @@ from flask_login import current_user, login_required, logout_user
 import os
 from flask_socketio import emit
 from backend.views import user_views
+from backend.api.v1.web_socket.sessions import end_user_sockets
 from backend.auth import AUTH
-from backend.db_ops.database import DB
+from backend.db_ops import db
 from backend.utils import utils
 
-db = DB()
-
 UPLOAD_FOLDER = 'frontend/static/uploads/avatars'
 MAX_FILE_SIZE_MB = 2
 
@@ -26,6 +25,7 @@ def logout():
         user = AUTH.authenticate_user()
         user_id = user.id
         AUTH.remove_session_id(user_id)
+        end_user_sockets(user_id)
         logout_user()  # also removes any remeber-me cookie
 
         # Redirect URL after successful logout
@@ -39,6 +39,7 @@ def logout():
         if current_user.is_authenticated:
             user_id = current_user.get_id()
             AUTH.remove_session_id(user_id)
+            end_user_sockets(user_id)
             logout_user()
         return redirect(url_for('pub_views.landing_page'))
 
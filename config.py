@@ -8,4 +8,97 @@ if os.path.exists('.env'):
     load_dotenv()
 
 class Config:
-    MONGO_URI = os.getenv('MONGODB_URI') or 'mongodb://127.0.0.1:27017'
+    MONGO_URI = os.getenv('MONGO_URI') or os.getenv('MONGODB_URI') or\
+        'mongodb://127.0.0.1:27017'
+    MONGO_DB_NAME = os.getenv('MONGO_DB_NAME') or 'test_db'
+
+    # MongoDB connection pool (one pool per worker process)
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50))
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(
+        os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 10000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+        os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    # comma separated wire compressors, e.g. 'zstd,snappy,zlib'
+    MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS') or 'zlib'
+
+    REDIS_URL = os.getenv('REDIS_URL') or 'redis://localhost:6379/0'
+
+    # Redis URL the Socket.IO workers relay their emits through, so a client
+    # receives events emitted by any worker. An empty value runs a single
+    # worker without a message queue
+    SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE', REDIS_URL)
+
+    # Token the internal /status/connections endpoint requires in the
+    # X-Status-Token header, the endpoint is disabled when it is empty
+    STATUS_TOKEN = os.getenv('STATUS_TOKEN', '')
+
+    # Read-through cache of user profiles kept in Redis
+    PROFILE_CACHE_ENABLED = os.getenv('PROFILE_CACHE_ENABLED', '1') == '1'
+    PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 3600))
+
+    # Seconds a chat stays marked as open without a client heartbeat
+    PRESENCE_TTL = int(os.getenv('PRESENCE_TTL', 60))
+    # Seconds between the renewals of the sockets registered by a worker,
+    # and seconds a socket stays registered without a renewal, e.g. after
+    # its worker crashed
+    SOCKET_HEARTBEAT_INTERVAL = int(os.getenv('SOCKET_HEARTBEAT_INTERVAL', 30))
+    SOCKET_TTL = int(os.getenv('SOCKET_TTL', 90))
+    # Seconds between broadcasts of the online status changes to friends
+    PRESENCE_BROADCAST_INTERVAL = int(
+        os.getenv('PRESENCE_BROADCAST_INTERVAL', 2))
+    # Seconds between flushes of last_seen times to MongoDB, and the number
+    # of users flushed per bulk write
+    LAST_SEEN_FLUSH_INTERVAL = int(os.getenv('LAST_SEEN_FLUSH_INTERVAL', 60))
+    LAST_SEEN_FLUSH_BATCH_SIZE = int(
+        os.getenv('LAST_SEEN_FLUSH_BATCH_SIZE', 500))
+
+    # Minimum milliseconds between two locations pushed to a subscriber
+    LOCATION_PUSH_INTERVAL_MS = int(
+        os.getenv('LOCATION_PUSH_INTERVAL_MS', 1000))
+
+    # Location updates closer than this to the stored location are dropped
+    LOCATION_MIN_MOVE_METERS = float(
+        os.getenv('LOCATION_MIN_MOVE_METERS', 10))
+    # Seconds between flushes of the hot locations to MongoDB, and the
+    # number of users flushed per bulk write
+    LOCATION_FLUSH_INTERVAL = int(os.getenv('LOCATION_FLUSH_INTERVAL', 5))
+    LOCATION_FLUSH_BATCH_SIZE = int(
+        os.getenv('LOCATION_FLUSH_BATCH_SIZE', 500))
+
+    # Location history: days kept, age in hours after which points are
+    # downsampled to one per LOCATION_HISTORY_DOWNSAMPLE_SECONDS, seconds
+    # between downsampling rounds and the longest trail window in hours
+    LOCATION_HISTORY_RETENTION_DAYS = int(
+        os.getenv('LOCATION_HISTORY_RETENTION_DAYS', 30))
+    LOCATION_HISTORY_DOWNSAMPLE_AFTER = int(
+        os.getenv('LOCATION_HISTORY_DOWNSAMPLE_AFTER', 24))
+    LOCATION_HISTORY_DOWNSAMPLE_SECONDS = int(
+        os.getenv('LOCATION_HISTORY_DOWNSAMPLE_SECONDS', 60))
+    LOCATION_HISTORY_DOWNSAMPLE_INTERVAL = int(
+        os.getenv('LOCATION_HISTORY_DOWNSAMPLE_INTERVAL', 3600))
+    LOCATION_TRAIL_MAX_HOURS = int(os.getenv('LOCATION_TRAIL_MAX_HOURS', 168))
+
+    # Bounds of the geofence radius in meters, and the number of geofences
+    # a user may define
+    GEOFENCE_MIN_RADIUS = int(os.getenv('GEOFENCE_MIN_RADIUS', 50))
+    GEOFENCE_MAX_RADIUS = int(os.getenv('GEOFENCE_MAX_RADIUS', 5000))
+    MAX_GEOFENCES_PER_USER = int(os.getenv('MAX_GEOFENCES_PER_USER', 20))
+    # Distance beyond the radius of a geofence a user must reach to leave
+    # it, absorbs the GPS jitter around the edge
+    GEOFENCE_HYSTERESIS_METERS = int(
+        os.getenv('GEOFENCE_HYSTERESIS_METERS', 25))
+
+    # Retention of notifications, applied by a periodic background sweeper
+    NOTIFICATION_RETENTION_DAYS = int(
+        os.getenv('NOTIFICATION_RETENTION_DAYS', 15))
+    NOTIFICATIONS_MAX_PER_USER = int(
+        os.getenv('NOTIFICATIONS_MAX_PER_USER', 500))
+    # seconds between sweeps, 0 disables the sweeper
+    NOTIFICATION_SWEEP_INTERVAL = int(
+        os.getenv('NOTIFICATION_SWEEP_INTERVAL', 600))
+    NOTIFICATION_SWEEP_BATCH_SIZE = int(
+        os.getenv('NOTIFICATION_SWEEP_BATCH_SIZE', 100))
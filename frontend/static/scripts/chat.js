@@ -6,6 +6,11 @@ $(document).ready(() => {
   let room;
   let lastVisitedFriend = '';
   let isChatSectionOpen = false;
+  let olderMessagesCursor = null; // cursor of the next older page of messages
+  let loadingOlderMessages = false;
+  let chatHeartbeat = null; // keeps the presence in the open chat alive
+
+  const CHAT_HEARTBEAT_INTERVAL = 20000;
 
   $('.chat-section').resizable({
     minWidth: 100,
@@ -69,6 +74,21 @@ $(document).ready(() => {
       chatbox.scrollTop(chatbox.prop('scrollHeight'));
     }
 
+    static prependMessages(messages) {
+      const chatbox = $('.chats');
+      const chatSection = $('.chat-section');
+      const previousHeight = chatSection.prop('scrollHeight');
+
+      const contents = Object.entries(messages).map(([, value]) => {
+        const chatClass = value.sender === friend ? 'friend-chat' : 'user-chat';
+        return `<div class="message ${chatClass}">${value.content}</div>`;
+      });
+      chatbox.prepend(contents.join(''));
+
+      // keeps the messages the user was reading in view
+      chatSection.scrollTop(chatSection.prop('scrollHeight') - previousHeight);
+    }
+
     static getChatsWithFriend(friend) {
       return new Promise((resolve, reject) => {
         $.ajax({
@@ -88,22 +108,22 @@ $(document).ready(() => {
     }
 
     static markReceivedMessagesAsRead(messageObj) {
-      const readMsgList = [];
-      // gets all unread messages where user === the receiver
-      Object.entries(messageObj).forEach(([id, msg]) => {
-        if (msg.receiver && msg.receiver !== friend && msg.read === false) {
-          readMsgList.push(id);
+      let cursor = messageObj.read_cursor;
+      // gets the newest message where user === the receiver
+      Object.values(messageObj.messages).forEach((msg) => {
+        if (msg.receiver !== friend && msg.seq > cursor) {
+          cursor = msg.seq;
         }
       });
 
-      // send a request to the endpoint to mark the messages as read
-      if (readMsgList.length !== 0) {
+      // send a request to the endpoint to mark the messages up to it as read
+      if (cursor > messageObj.read_cursor) {
         $.ajax({
           type: 'POST',
           url: '/api/user/friend/conversation/read',
           contentType: 'application/json',
           data: JSON.stringify({
-            messages: readMsgList,
+            cursor,
             conversation_id: messageObj.conversation_id,
           }),
           dataType: 'json',
@@ -115,17 +135,16 @@ $(document).ready(() => {
     }
 
     static updateUserChatLocation(friend, status) {
-      $.ajax({
-        url: '/api/user/isInChat/update',
-        type: 'POST',
-        contentType: 'application/json',
-        data: JSON.stringify({ friend, status }),
-        dataType: 'json',
-        success: () => {
-          // socket.emit('to reload friendSection', { friend });
-        },
-        error: (err) => { console.log(err); },
-      });
+      clearInterval(chatHeartbeat);
+      chatHeartbeat = null;
+      if (status === true) {
+        socket.emit('enterChat', { friend });
+        chatHeartbeat = setInterval(() => {
+          socket.emit('enterChat', { friend });
+        }, CHAT_HEARTBEAT_INTERVAL);
+      } else {
+        socket.emit('leaveChat', { friend });
+      }
     }
 
     static friendIsInChat(friend) {
@@ -146,6 +165,11 @@ $(document).ready(() => {
       });
     }
 
+    static showOnlineStatus(statusDiv, online, lastSeen) {
+      statusDiv.toggleClass('online', online === true);
+      statusDiv.attr('title', online === true ? 'online' : `last seen ${lastSeen || 'a while ago'}`);
+    }
+
     static reloadFriends() {
       if (isChatSectionOpen === false) {
         lastVisitedFriend = '';
@@ -178,6 +202,10 @@ $(document).ready(() => {
             const nameDiv = $('<div>', { class: 'name', text: username });
             friendContainer.append(nameDiv);
 
+            const statusDiv = $('<div>', { class: 'online-status' });
+            helperFunctions.showOnlineStatus(statusDiv, value.online, value.last_seen);
+            friendContainer.append(statusDiv);
+
             if (unreadMessages === true) {
               const unreadChats = $('<div>', { class: 'unread-chats' });
               friendContainer.append(unreadChats);
@@ -286,6 +314,7 @@ $(document).ready(() => {
   socket.on('prevMessages', (messagesDict) => {
     let loaded = false; // Avoids multiple reloading when the friend is clicked multiple times
     const { messages } = messagesDict;
+    olderMessagesCursor = messagesDict.before;
     if (loaded === false) {
       $('.chats').empty();
       Object.entries(messages).forEach(([, value]) => {
@@ -297,6 +326,28 @@ $(document).ready(() => {
     }
   });
 
+  // Loads the page of messages older than the ones displayed
+  socket.on('olderMessages', (messagesDict) => {
+    olderMessagesCursor = messagesDict.before;
+    loadingOlderMessages = false;
+    helperFunctions.prependMessages(messagesDict.messages);
+  });
+
+  $('.chat-section').on('scroll', function () {
+    if ($(this).scrollTop() === 0 && olderMessagesCursor && !loadingOlderMessages) {
+      loadingOlderMessages = true;
+      socket.emit('loadOlderMessages', { room, before: olderMessagesCursor });
+    }
+  });
+
+  // Updates the online status of friends that went online or offline
+  socket.on('presence', (data) => {
+    data.friends.forEach((status) => {
+      const statusDiv = $(`.friend-container[data-friend="${status.username}"] .online-status`);
+      helperFunctions.showOnlineStatus(statusDiv, status.online, status.last_seen);
+    });
+  });
+
   socket.on('reload friend section', () => {
     helperFunctions.reloadFriends();
   });
@@ -6,7 +6,7 @@ $(document).ready(() => {
   let routingControl;
   const locationThumbnail = $('#location-thumb');
   let geoLocationId;
-  let intervalId;
+  let trackedFriend = null; // friend whose location stream is subscribed to
   let userLatLong;
   let userMarker;
   const legend = $('#legend');
@@ -118,7 +118,8 @@ $(document).ready(() => {
     if (!userLatLong) {
       const message = `Cannot view ${friend} on the map, your location is turned off`;
       socket.emit('send error message', { message });
-      clearInterval(intervalId);
+      // eslint-disable-next-line no-use-before-define
+      stopFriendLocation();
       $('#map').hide();
     } else {
       createMap();
@@ -126,9 +127,10 @@ $(document).ready(() => {
       const [friendLat, friendLong] = friendCords;
       const [userLat, userLong] = userLatLong;
 
-      // Stops the setinterval and watchgeolocation when user arrives his destination
+      // Stops the location stream and watchgeolocation when user arrives his destination
       if (friendLat === userLat && friendLong === userLong) {
-        clearInterval(intervalId);
+        // eslint-disable-next-line no-use-before-define
+        stopFriendLocation();
         navigator.geolocation.clearWatch(geoLocationId);
       }
 
@@ -179,42 +181,38 @@ $(document).ready(() => {
   }
 
   /**
-   * Send a request to retrieve friend location.
+   * Subscribe to the location stream of a friend, the server pushes the
+   * friend location whenever it changes.
    * @param {string} friend - friend username.
    */
   function getFriendLocation(friend) {
-    let accessGranted = true;
-    intervalId = setInterval(() => {
-      if (accessGranted) {
-        $.ajax({
-          type: 'POST',
-          url: '/api/user/friend/current_location',
-          contentType: 'application/json',
-          data: JSON.stringify({ friend }),
-          dataType: 'json',
-          success: (resp) => {
-            friendLatLong = resp.location;
-            loadOnMap(friendLatLong);
-          },
-          error: (resp) => {
-            $('.map-section .loading-spinner').hide(); // hide loading spin
-            let message;
-            if (resp.status === 404) {
-              message = `${friend}'s location is currently unavailable.`;
-            } else {
-              // if 400
-              message = `${friend} did not grant you track access or no more exist`;
-            }
-            socket.emit('send error message', { message });
-            accessGranted = false;
-          },
-        });
-      } else {
-        clearInterval(intervalId);
-      }
-    }, 5000);
+    trackedFriend = friend;
+    socket.emit('subscribeLocation', { friend });
+  }
+
+  function stopFriendLocation() {
+    if (trackedFriend !== null) {
+      trackedFriend = null;
+      socket.emit('unsubscribeLocation');
+    }
   }
 
+  socket.on('friendLocation', (data) => {
+    if (data.friend === trackedFriend) {
+      loadOnMap(data.location);
+    }
+  });
+
+  socket.on('locationError', (data) => {
+    $('.map-section .loading-spinner').hide(); // hide loading spin
+    if (data.friend === trackedFriend) {
+      socket.emit('send error message', { message: data.message });
+      if (data.subscribed !== true) {
+        stopFriendLocation();
+      }
+    }
+  });
+
   if (navigator.geolocation) {
     $('.map-section .loading-spinner').show(); // loading spin
     geoLocationId = navigator.geolocation.watchPosition(
@@ -231,7 +229,7 @@ $(document).ready(() => {
     friend = $(this).data('friend');
 
     $('#compass').on('click', () => {
-      clearInterval(intervalId); // clear prev interval as user clicks from one friend to another
+      stopFriendLocation(); // clear prev stream as user clicks from one friend to another
       $('.map-section .loading-spinner').show(); // show loading spin
       $('.map-section').show(); // for mobile view
       getFriendLocation(friend);
@@ -249,7 +247,7 @@ $(document).ready(() => {
           && !mapContainer.contains(event.target)
           && !pincher.contains(event.target)
           && !mapSection.contains(event.target)) {
-        clearInterval(intervalId);
+        stopFriendLocation();
         clearMap();
         showUserOnMap();
       }
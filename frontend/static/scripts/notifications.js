@@ -3,6 +3,14 @@ $(document).ready(() => {
   const socket = io(`${window.location.protocol}//${window.location.host}`, { transports: ['websocket'] });
 
   let loadedFriendRequests = false;
+  // paging state of the notification streams: the newest general
+  // notification held and the cursors of the next (older) pages
+  let newestGeneralNotification = null;
+  let olderGeneralNotifications = null;
+  let olderFriendRequests = null;
+  let loadingNotifications = false;
+
+  const NOTIFICATIONS_PAGE_SIZE = 20;
 
   class Helpers {
     static ringNotificationBell() {
@@ -13,84 +21,162 @@ $(document).ready(() => {
       $('#notification').css('background-image', 'url(static/images/icons8-notification-96.png)');
     }
 
+    static generalNotificationHtml(id, notification) {
+      const { date } = notification;
+      const { message } = notification;
+      const idStr = parseInt(id, 10).toString();
+      if (notification.read === true) {
+        return `<div class="gen-message" data-id=${idStr} style="color: rgb(80, 74, 74)">${message} : ${date}</div>`;
+      }
+      return `<div class="gen-message" data-id=${idStr}>${message} : ${date}</div>`;
+    }
+
     static loadGeneralNotifications() {
       $('.friend-req-box').hide();
       $('.gen-msgs').show();
       $('#friend-requests').css('background-color', 'rgb(240, 236, 236, 0.1)');
       $('#gen-notifications').css('background-color', 'rgb(145, 134, 245)');
 
-      socket.emit('get_general_notifications');
-      socket.on('show_general_notifications', (resp) => {
-        const generalNotifications = resp.data;
-        const generalNotificationDiv = $('.gen-msgs');
-        const genMessage = $('.gen-message');
-        // const notificationBox = $('.notification-box');
+      // only fetches the notifications newer than the ones already shown
+      if (newestGeneralNotification === null) {
+        socket.emit('get_general_notifications', { limit: NOTIFICATIONS_PAGE_SIZE });
+      } else {
+        socket.emit('get_general_notifications', {
+          since: newestGeneralNotification, limit: NOTIFICATIONS_PAGE_SIZE,
+        });
+      }
+    }
 
-        if (Object.keys(generalNotifications).length === 0) {
-          genMessage.text('You have no notification yet');
-        } else {
-          $('.gen-msgs').empty();
-
-          Object.entries(generalNotifications).forEach(([id, notification]) => {
-            const { date } = notification;
-            const { message } = notification;
-            let not;
-            const idStr = parseInt(id, 10).toString();
-            if (notification.read === true) {
-              not = `<div class="gen-message" data-id=${idStr} style="color: rgb(80, 74, 74)">${message} : ${date}</div>`;
-            } else {
-              not = `<div class="gen-message" data-id=${idStr}">${message} : ${date}</div>`;
-            }
-            generalNotificationDiv.append(not);
-            generalNotificationDiv.scrollTop(generalNotificationDiv.prop('scrollHeight'));
-          });
-        }
+    static loadOlderGeneralNotifications() {
+      if (olderGeneralNotifications === null || loadingNotifications) {
+        return;
+      }
+      loadingNotifications = true;
+      socket.emit('get_general_notifications', {
+        before: olderGeneralNotifications, limit: NOTIFICATIONS_PAGE_SIZE,
       });
     }
 
     static loadFriendRequests() {
       if (loadedFriendRequests === false) {
-        socket.emit('get_friend_requests');
-        socket.on('user_friend_requests', (resp) => {
-          const allReqs = resp.data;
-          if (Object.keys(allReqs).length === 0) {
-            $('.friend-req-box').text('You have no friend request at this moment');
-            $('.friend-req-box').css('border-bottom', '1px solid gray');
-          } else {
-            Object.entries(allReqs).forEach(([id, request]) => {
-              const { date } = request;
-              const { from } = request;
-              const { avatar } = request;
-              const upper = $('.upper');
-
-              let avatarThumb;
-              if (avatar) {
-                avatarThumb = `<img class="images avatar" src="static/${avatar}" alt="User Avatar">`;
-              } else {
-                avatarThumb = '<img class="images avatar" src="static/images/icons8-avatar-96.png" alt="User Avatar">';
-              }
-              upper.append(avatarThumb);
-
-              const friendInfo = `
-              <div class="friend-info" data-id=${id}><strong>${from}</strong><br>${date}</div>`;
-              upper.append(friendInfo);
-
-              $('.friend-req-box').css('height', '70px'); // reset the height
-
-              const lower = $('.lower');
-              const decline = `<div class="mid-btn decline" data-friend=${from} data-id=${id}>decline</div>`;
-              const accept = `<div class="mid-btn accept" data-friend=${from} data-id=${id}>accept</div>`;
-
-              lower.append(decline);
-              lower.append(accept);
-            });
-          }
-          loadedFriendRequests = true;
-        });
+        socket.emit('get_friend_requests', { limit: NOTIFICATIONS_PAGE_SIZE });
       }
     }
+
+    static loadOlderFriendRequests() {
+      if (olderFriendRequests === null || loadingNotifications) {
+        return;
+      }
+      loadingNotifications = true;
+      socket.emit('get_friend_requests', {
+        before: olderFriendRequests, limit: NOTIFICATIONS_PAGE_SIZE,
+      });
+    }
   }
 
+  // Shows a page of general notifications, oldest at the top
+  socket.on('show_general_notifications', (resp) => {
+    const generalNotifications = resp.data;
+    const generalNotificationDiv = $('.gen-msgs');
+    const ids = Object.keys(generalNotifications).map((id) => parseInt(id, 10));
+    const html = ids.sort((a, b) => a - b)
+      .map((id) => Helpers.generalNotificationHtml(id, generalNotifications[id]))
+      .join('');
+
+    if (resp.before !== null && resp.before !== undefined) {
+      // older page, kept above the current ones at the same scroll position
+      loadingNotifications = false;
+      olderGeneralNotifications = resp.next;
+      const previousHeight = generalNotificationDiv.prop('scrollHeight');
+      generalNotificationDiv.prepend(html);
+      generalNotificationDiv.scrollTop(generalNotificationDiv.prop('scrollHeight') - previousHeight);
+      return;
+    }
+
+    if (resp.since !== null && resp.since !== undefined) {
+      if (ids.length > 0) {
+        newestGeneralNotification = Math.max(...ids);
+        generalNotificationDiv.append(html);
+      }
+      if (resp.next !== null) {
+        // more new notifications than a page, follows them oldest first
+        socket.emit('get_general_notifications', {
+          since: resp.next, limit: NOTIFICATIONS_PAGE_SIZE,
+        });
+      }
+    } else if (ids.length === 0) {
+      generalNotificationDiv.html('<div class="gen-message">You have no notification yet</div>');
+      return;
+    } else {
+      olderGeneralNotifications = resp.next;
+      newestGeneralNotification = Math.max(...ids);
+      generalNotificationDiv.html(html);
+    }
+    generalNotificationDiv.scrollTop(generalNotificationDiv.prop('scrollHeight'));
+  });
+
+  // Shows a page of friend requests, newest first
+  socket.on('user_friend_requests', (resp) => {
+    const allReqs = resp.data;
+    const olderPage = resp.before !== null && resp.before !== undefined;
+    const upper = $('.upper');
+    const lower = $('.lower');
+    loadingNotifications = false;
+    olderFriendRequests = resp.next;
+
+    if (!olderPage) {
+      upper.empty();
+      lower.empty();
+    }
+    if (Object.keys(allReqs).length === 0) {
+      if (!olderPage) {
+        upper.text('You have no friend request at this moment');
+        $('.friend-req-box').css('border-bottom', '1px solid gray');
+      }
+    } else {
+      Object.keys(allReqs).sort((a, b) => b - a).forEach((id) => {
+        const request = allReqs[id];
+        const { date } = request;
+        const { from } = request;
+        const { avatar } = request;
+
+        let avatarThumb;
+        if (avatar) {
+          avatarThumb = `<img class="images avatar" src="static/${avatar}" alt="User Avatar">`;
+        } else {
+          avatarThumb = '<img class="images avatar" src="static/images/icons8-avatar-96.png" alt="User Avatar">';
+        }
+        upper.append(avatarThumb);
+
+        const friendInfo = `
+        <div class="friend-info" data-id=${id}><strong>${from}</strong><br>${date}</div>`;
+        upper.append(friendInfo);
+
+        $('.friend-req-box').css('height', '70px'); // reset the height
+
+        const decline = `<div class="mid-btn decline" data-friend=${from} data-id=${id}>decline</div>`;
+        const accept = `<div class="mid-btn accept" data-friend=${from} data-id=${id}>accept</div>`;
+
+        lower.append(decline);
+        lower.append(accept);
+      });
+    }
+    loadedFriendRequests = true;
+  });
+
+  // Loads older pages when the notification lists are scrolled to their end
+  $('.gen-msgs').on('scroll', function () {
+    if ($(this).scrollTop() === 0) {
+      Helpers.loadOlderGeneralNotifications();
+    }
+  });
+
+  $('.friend-req-box').on('scroll', function () {
+    if ($(this).scrollTop() + $(this).innerHeight() >= this.scrollHeight - 1) {
+      Helpers.loadOlderFriendRequests();
+    }
+  });
+
   // Handles user click on add friend icon
   $('#add-friend-box').on('click', '#add-icon', (event) => {
     $('#add-friend-input').show();
@@ -5,9 +5,14 @@ from dotenv import load_dotenv
 from flask import Flask, jsonify, request
 from flask_login import LoginManager
 from flask_cors import CORS
+from pymongo.errors import PyMongoError
 from backend.views import user_views, pub_views
 from backend.api.v1.routes import api
 from backend.api.v1.web_socket.chat import socket_io
+from backend.api.v1.web_socket.tasks import start_background_tasks
+from backend.db_ops import db, identity_map
+from backend.db_ops.indexes import ensure_indexes
+from config import Config
 
 
 # Loads the .env file
@@ -22,7 +27,18 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 CORS(app, resources={r"backend/api/v1/*": {"origins": "*"}})
 
 # Initialize flask app with SockeIO
-socket_io.init_app(app, async_mode='eventlet', cors_allowed_origins="*")
+socket_io.init_app(app, async_mode='eventlet', cors_allowed_origins="*",
+                   message_queue=Config.SOCKETIO_MESSAGE_QUEUE or None)
+
+# Periodic maintenance (notification retention sweeps)
+start_background_tasks()
+
+# Create the database indexes the app queries rely on, a missing unique
+# index (IndexCreationError) stops the app from serving
+try:
+    ensure_indexes(db.database)
+except PyMongoError as e:
+    print(f"Error: could not create database indexes: {e}")
 
 # Set global strict slashes
 app.url_map.strict_slashes = False
@@ -47,11 +63,17 @@ def before_request():
         AUTH.authenticate_user()
 
 
+@app.teardown_appcontext
+def clear_identity_maps(exception=None):
+    ''' Drops the users and conversations loaded while handling the request
+    or Socket.IO event
+    '''
+    identity_map.clear()
+
+
 @login.user_loader
 def load_user(user_id):
     # Load user
-    from backend.db_ops.database import DB
-    db = DB()
     return db.find_user_by(id=user_id)
 
 
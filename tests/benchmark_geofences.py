@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+''' Geofence transitions benchmark
+Indexes GEOFENCE_COUNT zones in the Redis of REDIS_URL, spread over
+OWNER_COUNT owners around a city, and measures the cost of
+Geofences.transitions for a user tracked by TRACKER_COUNT of them moving
+through the city. The cost depends on the zones of the trackers near the
+user, not on the total number of zones.
+Run with:
+    python -m tests.benchmark_geofences
+The keys written are deleted at the end.
+'''
+import json
+import random
+import statistics
+import time
+from backend.db_ops.connections import get_redis_connection
+from backend.db_ops.geofences import LOADED_FIELD, geofences
+
+GEOFENCE_COUNT = 100000
+OWNER_COUNT = GEOFENCE_COUNT // 20
+TRACKER_COUNT = 50
+UPDATE_COUNT = 2000
+# center and half width in degrees of the area the zones and moves are in
+CENTER = (6.5244, 3.3792)
+SPREAD = 0.2
+USER_ID = 'bench-user'
+
+
+def owner_id(i: int) -> str:
+    ''' Returns the id of the i-th benchmark owner '''
+    return f'bench-owner-{i}'
+
+
+def random_location() -> list:
+    ''' Returns a random [lat, long] pair in the benchmark area '''
+    return [CENTER[0] + random.uniform(-SPREAD, SPREAD),
+            CENTER[1] + random.uniform(-SPREAD, SPREAD)]
+
+
+def index_geofences(redis_client) -> None:
+    ''' Indexes the benchmark zones the way Geofences._load does '''
+    pipe = redis_client.pipeline(transaction=False)
+    for i in range(GEOFENCE_COUNT):
+        owner = owner_id(i % OWNER_COUNT)
+        lat, long = random_location()
+        pipe.hset(f'geofences:{owner}', f'zone-{i}', json.dumps(
+            {'name': f'zone {i}', 'radius': random.randint(50, 500)}))
+        pipe.geoadd(f'geofences:{owner}:geo', [long, lat, f'zone-{i}'])
+        if len(pipe) >= 10000:
+            pipe.execute()
+    for i in range(OWNER_COUNT):
+        pipe.hset(f'geofences:{owner_id(i)}', LOADED_FIELD, 1)
+    pipe.execute()
+
+
+def delete_geofences(redis_client) -> None:
+    ''' Deletes the keys written by the benchmark '''
+    keys = [f'geofence_state:{USER_ID}']
+    for i in range(OWNER_COUNT):
+        keys.extend([f'geofences:{owner_id(i)}',
+                     f'geofences:{owner_id(i)}:geo'])
+    for i in range(0, len(keys), 1000):
+        redis_client.delete(*keys[i:i + 1000])
+
+
+def main() -> None:
+    ''' Runs the benchmark and prints the per update cost '''
+    redis_client = get_redis_connection()
+    random.seed(0)
+    index_geofences(redis_client)
+    try:
+        trackers = [owner_id(i) for i in range(TRACKER_COUNT)]
+        durations, transitions = [], 0
+        for _ in range(UPDATE_COUNT):
+            location = random_location()
+            start = time.perf_counter()
+            transitions += len(geofences.transitions(USER_ID, trackers,
+                                                     location))
+            durations.append((time.perf_counter() - start) * 1000)
+        durations.sort()
+        print(f'{GEOFENCE_COUNT} zones, {TRACKER_COUNT} trackers, '
+              f'{UPDATE_COUNT} updates, {transitions} transitions')
+        print(f'per update: mean {statistics.mean(durations):.3f} ms, '
+              f'p50 {durations[len(durations) // 2]:.3f} ms, '
+              f'p99 {durations[int(len(durations) * 0.99)]:.3f} ms')
+    finally:
+        delete_geofences(redis_client)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+''' Test fixtures
+The tests run against a local mongod and Redis, like the app in production.
+They use the TEST_MONGO_DB_NAME database and the TEST_REDIS_URL database,
+both emptied after every test, and are skipped when the servers are not
+reachable. The greenlets of the tests are scheduled by eventlet the way the
+gunicorn eventlet worker schedules the requests.
+'''
+import eventlet
+eventlet.monkey_patch()
+
+import os
+
+os.environ['MONGO_DB_NAME'] = os.getenv('TEST_MONGO_DB_NAME', 'guildme_test')
+os.environ['REDIS_URL'] = os.getenv('TEST_REDIS_URL',
+                                    'redis://localhost:6379/15')
+os.environ.setdefault('MONGO_SERVER_SELECTION_TIMEOUT_MS', '2000')
+
+import pytest
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
+from backend.db_ops.connections import get_mongo_client, get_redis_connection
+from config import Config
+
+
+@pytest.fixture
+def mongo_database():
+    ''' The test database with the app indexes, dropped after the test '''
+    from backend.db_ops.indexes import ensure_indexes
+
+    client = get_mongo_client()
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        pytest.skip(f'no mongod reachable at {Config.MONGO_URI}')
+    client.drop_database(Config.MONGO_DB_NAME)
+    database = client[Config.MONGO_DB_NAME]
+    ensure_indexes(database)
+    yield database
+    client.drop_database(Config.MONGO_DB_NAME)
+
+
+@pytest.fixture
+def redis_connection():
+    ''' The test Redis database, flushed before and after the test '''
+    connection = get_redis_connection()
+    try:
+        connection.flushdb()
+    except RedisError:
+        pytest.skip(f'no Redis reachable at {Config.REDIS_URL}')
+    yield connection
+    connection.flushdb()
+
+
+@pytest.fixture
+def make_user(mongo_database):
+    ''' Creates users in the test database, their avatar copies are deleted
+    after the test
+    '''
+    from backend.db_ops import db
+
+    users = []
+
+    def make(username: str, **kwargs):
+        user = db.add_user(username=username, email=f'{username}@test.io',
+                           full_name=username, _password='password',
+                           **kwargs)
+        users.append(user)
+        return user
+    yield make
+    for user in users:
+        avatar_path = f'frontend/static/{user.avatar}'
+        if user.avatar.startswith('uploads/') and os.path.exists(avatar_path):
+            os.remove(avatar_path)
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+''' Socket.IO worker of the message queue test
+Runs the app (guildMe:app) as one single-process eventlet worker, the way
+each worker of a multi-worker deployment runs, with the configuration of
+the environment.
+Run with:
+    python -m tests.socketio_worker <port>
+'''
+import eventlet
+eventlet.monkey_patch()
+
+import sys
+from guildMe import app, socket_io
+
+
+if __name__ == '__main__':
+    socket_io.run(app, host='127.0.0.1', port=int(sys.argv[1]))
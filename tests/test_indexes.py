@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+''' Tests of the database indexes '''
+from backend.db_ops import db
+from backend.db_ops.indexes import missing_indexes, unindexed_queries
+
+
+def test_declared_indexes_exist(mongo_database):
+    ''' Every declared index is created '''
+    assert missing_indexes(mongo_database) == {}
+
+
+def test_queries_use_an_index(mongo_database):
+    ''' explain() shows no query shape of the DB class is answered by a
+    collection scan
+    '''
+    assert unindexed_queries(db.database) == []
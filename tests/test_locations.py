@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+''' Tests of the GeoJSON locations and of the nearby friends query '''
+from backend.db_ops import db
+from backend.db_ops.migrations import swap_location_coordinates
+from backend.models.helpers import LOCATION_FORMAT, location_coordinates,\
+    make_location
+
+LAGOS = [6.5244, 3.3792]
+
+
+def test_locations_are_stored_long_lat(make_user, mongo_database):
+    ''' [lat, long] pairs are stored as GeoJSON [long, lat] points '''
+    user = make_user('alice')
+    db.update_user(user.id, location=LAGOS)
+
+    stored = mongo_database.users.find_one({'id': user.id})
+    assert stored['location'] == {'type': 'Point',
+                                  'coordinates': [LAGOS[1], LAGOS[0]]}
+    assert location_coordinates(stored['location']) == LAGOS
+
+
+def test_locations_have_a_2dsphere_index(mongo_database):
+    ''' The locations are indexed for the geospatial queries '''
+    indexes = mongo_database.users.index_information()
+    assert list(indexes['location_2dsphere']['key'])\
+        == [('location', '2dsphere')]
+
+
+def test_swap_location_coordinates_runs_once(mongo_database):
+    ''' The migration swaps the legacy [lat, long] points once, running it
+    again after an interruption leaves the swapped users as they are
+    '''
+    # the index rejects the empty legacy locations, it is created after
+    # the migration
+    mongo_database.users.drop_index('location_2dsphere')
+    legacy = {'type': 'Point', 'coordinates': LAGOS}
+    mongo_database.users.insert_many([
+        {'id': 'a', 'username': 'a', 'email': 'a@test.io', 'location': {},
+         'allowed_tracks': {'b': {'username': 'b', 'location': legacy}}},
+        {'id': 'b', 'username': 'b', 'email': 'b@test.io',
+         'location': legacy},
+    ])
+
+    swap_location_coordinates(mongo_database)
+    swap_location_coordinates(mongo_database)
+
+    a = mongo_database.users.find_one({'id': 'a'})
+    b = mongo_database.users.find_one({'id': 'b'})
+    assert b['location']['coordinates'] == [LAGOS[1], LAGOS[0]]
+    assert a['allowed_tracks']['b']['location'] == b['location']
+    assert a['location'] is None
+    assert a['location_format'] == b['location_format'] == LOCATION_FORMAT
+
+
+def test_swap_location_coordinates_skips_app_writes(make_user,
+                                                    mongo_database):
+    ''' Locations written by the app while the migration is pending are
+    already [long, lat], the migration leaves them and the copies of them
+    as they are
+    '''
+    alice, bob = make_user('alice'), make_user('bob')
+    db.update_user(alice.id, location=LAGOS)
+    db.update_user_map(bob.id, 'allowed_tracks', alice.id,
+                       {'username': 'alice', 'location': make_location(LAGOS)})
+    db.update_locations({bob.id: [LAGOS, 1]})
+
+    swap_location_coordinates(mongo_database)
+
+    stored = {user['id']: user for user in mongo_database.users.find()}
+    assert stored[alice.id]['location'] == make_location(LAGOS)
+    assert stored[bob.id]['location'] == make_location(LAGOS)
+    assert stored[bob.id]['allowed_tracks'][alice.id]['location']\
+        == make_location(LAGOS)
+
+
+def test_nearby_users_are_sorted_and_restricted(make_user):
+    ''' $geoNear returns the given users within the radius, nearest first
+    '''
+    near, nearer, far, stranger = (make_user(name) for name in
+                                   ('near', 'nearer', 'far', 'stranger'))
+    # about 1.1 km, 110 m, 110 km and 10 m from the origin
+    db.update_user(near.id, location=[LAGOS[0] + 0.01, LAGOS[1]])
+    db.update_user(nearer.id, location=[LAGOS[0] + 0.001, LAGOS[1]])
+    db.update_user(far.id, location=[LAGOS[0] + 1, LAGOS[1]])
+    db.update_user(stranger.id, location=[LAGOS[0] + 0.0001, LAGOS[1]])
+
+    users = db.get_nearby_users([near.id, nearer.id, far.id], LAGOS, 5000)
+
+    assert [user['username'] for user in users] == ['nearer', 'near']
+    assert users[0]['distance'] < users[1]['distance'] < 5000
+    assert users[0]['location'] == [LAGOS[0] + 0.001, LAGOS[1]]
+
+
+def test_make_location_rejects_invalid_pairs():
+    ''' Only numeric [lat, long] pairs become GeoJSON points '''
+    assert make_location(LAGOS)['coordinates'] == [LAGOS[1], LAGOS[0]]
+    assert make_location([1]) is None
+    assert make_location(['a', 'b']) is None
+    assert make_location(None) is None
+
+
+def test_flush_after_user_removal_keeps_no_history(make_user, mongo_database,
+                                                   redis_connection):
+    ''' The hot location of a removed user is dropped with the user, a
+    flush afterwards recreates neither the location nor its history
+    '''
+    from backend.api.v1.web_socket.tasks import flush_locations
+    from backend.db_ops.location_store import location_store
+
+    user = make_user('alice')
+    location_store.update(user.id, LAGOS)
+    assert db.remove_user(user.id)
+
+    flush_locations()
+
+    assert location_store.get(user.id) is None
+    assert mongo_database.location_history.count_documents(
+        {'user_id': user.id}) == 0
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+''' Tests of the Socket.IO message queue between workers '''
+import os
+import socket
+import subprocess
+import sys
+import time
+import eventlet
+import socketio
+from backend.db_ops import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMEOUT = 10
+
+
+def free_port() -> int:
+    ''' Returns a local port nothing listens on '''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_worker(port: int) -> subprocess.Popen:
+    ''' Starts a worker of the app on the test databases and waits until it
+    accepts connections. The message queue is left to its default, the
+    REDIS_URL of the app
+    '''
+    env = dict(os.environ)
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    worker = subprocess.Popen(
+        [sys.executable, '-m', 'tests.socketio_worker', str(port)],
+        cwd=ROOT, env=env)
+    deadline = time.time() + TIMEOUT
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return worker
+        except OSError:
+            eventlet.sleep(0.1)
+    worker.kill()
+    raise RuntimeError(f'worker on port {port} did not start')
+
+
+def connect(port: int, session_id: str) -> socketio.Client:
+    ''' Connects a client authenticated by its session_id cookie '''
+    client = socketio.Client()
+    client.connect(f'http://127.0.0.1:{port}',
+                   headers={'Cookie': f'session_id={session_id}'},
+                   transports=['polling'])
+    return client
+
+
+def test_friend_request_alerts_a_client_of_another_worker(
+        make_user, redis_connection):
+    ''' A friend request sent through one worker alerts the friend connected
+    to another worker
+    '''
+    alice, bob = make_user('alice'), make_user('bob')
+    db.update_user(alice.id, session_id='session-alice')
+    db.update_user(bob.id, session_id='session-bob')
+
+    ports = [free_port(), free_port()]
+    workers = [start_worker(port) for port in ports]
+    clients = []
+    alerts, replies = eventlet.queue.Queue(), eventlet.queue.Queue()
+    try:
+        receiver = connect(ports[1], 'session-bob')
+        clients.append(receiver)
+        receiver.on('alert_user', lambda data=None: alerts.put(True))
+        sender = connect(ports[0], 'session-alice')
+        clients.append(sender)
+        sender.on('success', replies.put)
+        # lets the workers subscribe to the message queue
+        eventlet.sleep(1)
+
+        sender.emit('new_friend_request', {'data': 'bob'})
+
+        assert 'message' in replies.get(timeout=TIMEOUT)
+        assert alerts.get(timeout=TIMEOUT) is True
+    finally:
+        for client in clients:
+            client.disconnect()
+        for worker in workers:
+            worker.terminate()
+            worker.wait(TIMEOUT)
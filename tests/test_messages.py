@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+''' Tests of the message append path '''
+import eventlet
+from backend.db_ops import db
+from backend.db_ops.database import MAX_MESSAGES_PAGE_SIZE, next_page_cursor
+
+SENDERS = 200
+
+
+def read_all_messages(conversation_id: str) -> list:
+    ''' Reads every message of a conversation, page by page '''
+    messages, before = [], None
+    while True:
+        page = db.get_messages(conversation_id, before,
+                               MAX_MESSAGES_PAGE_SIZE)
+        messages.extend(page.values())
+        before = next_page_cursor(page)
+        if before is None:
+            return messages
+
+
+def test_concurrent_senders_lose_no_message(make_user):
+    ''' Many greenlets sending in the same conversation at once each get
+    their own sequence number and every message is stored
+    '''
+    alice, bob = make_user('alice'), make_user('bob')
+    conversation = db.get_or_create_conversation(alice.id, bob.id)
+
+    def send(i: int):
+        sender, receiver = (alice, bob) if i % 2 else (bob, alice)
+        return db.new_message(sender.id, receiver.id, f'message {i}')
+
+    pool = eventlet.GreenPool(SENDERS)
+    stored = list(pool.imap(send, range(SENDERS)))
+
+    assert all(stored)
+    assert sorted(message['seq'] for message in stored)\
+        == list(range(1, SENDERS + 1))
+
+    messages = read_all_messages(conversation.id)
+    assert sorted(message['content'] for message in messages)\
+        == sorted(f'message {i}' for i in range(SENDERS))
+    assert sorted(message['seq'] for message in messages)\
+        == list(range(1, SENDERS + 1))
+    assert db.find_conversation_by(id=conversation.id).message_count\
+        == SENDERS
+
+
+def test_new_message_returns_the_stored_message(make_user):
+    ''' The appended message is returned for the socket handler to emit '''
+    alice, bob = make_user('alice'), make_user('bob')
+    db.get_or_create_conversation(alice.id, bob.id)
+
+    stored = db.new_message(alice.id, bob.id, 'hello')
+
+    assert stored['content'] == 'hello'
+    assert stored['sender'] == 'alice'
+    assert stored['receiver'] == 'bob'
+    assert stored['seq'] == 1